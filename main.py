@@ -1,9 +1,17 @@
 
 
+import sys
 import logging
-from src.masmarchaapp import MasMarchaApp
 
 logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
 
-app = MasMarchaApp()
-app.run()
+if __name__ == '__main__':
+    # Los procesos de trabajo de Explorer importan este módulo al iniciar.
+    if sys.argv[1:2] == ['batch']:
+        # python main.py batch ...: videos por lotes, sin interfaz. El resto
+        # de los argumentos son de kivy.
+        from src.batch import main
+        sys.exit(main(sys.argv[2:]))
+    from src.masmarchaapp import MasMarchaApp
+    app = MasMarchaApp()
+    app.run()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+u"""Análisis de videos por lotes, sin interfaz gráfica.
+
+Uso: python main.py batch [-w WORKERS] VIDEO|DIRECTORIO [VIDEO|DIRECTORIO ...]
+
+Cada video se procesa en un proceso de trabajo (explorar, encontrar
+marcadores, ciclar y calcular la cinemática) y sus resultados se guardan en
+su propia sesión, igual que desde la aplicación.
+"""
+
+# Copyright (C) 2019  Mariano Ramis
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import csv
+import logging
+import argparse
+from collections import Counter
+from time import perf_counter
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from .video import Explorer
+from .settings import app_config, SESSION_DIR
+from .kinematics import Kinematics
+from .profiling import profiler
+from .session import set_session, write_outputs
+
+
+VIDEO_EXTENSIONS = ('.avi', '.mp4', '.mov', '.mkv', '.mpg', '.mpeg', '.wmv')
+
+SUMMARY_FIELDS = ('source', 'session', 'frames', 'walks', 'cycles',
+                  'walks_s', 'report_s', 'total_s', 'error')
+
+
+def analyze(config, source, name=None):
+    u"""Procesa un video completo y devuelve un resumen con los tiempos.
+
+    Los errores no se propagan: se registran y se informan en el resumen,
+    para no interrumpir el resto del lote. name es el nombre de la sesión
+    (ver set_session).
+    """
+    summary = dict.fromkeys(SUMMARY_FIELDS, '')
+    summary['source'] = source
+    start = perf_counter()
+    profiler.configure(config)
+    try:
+        summary['session'] = set_session(config, source, name)
+        explorer = Explorer(config)
+        explorer.open_file(source)
+        kinematics = Kinematics(config)
+        explorer.find_walks(onwalk=kinematics.push_walk)
+        kinematics.cycle_walks(explorer.walks)
+        summary['frames'] = explorer.nframes
+        summary['walks'] = len(explorer.walks)
+        summary['cycles'] = kinematics.cycler.active.sum()
+        summary['walks_s'] = round(perf_counter() - start, 3)
+
+        partial = perf_counter()
+        write_outputs(config, source, explorer.walks, kinematics)
+        summary['report_s'] = round(perf_counter() - partial, 3)
+    except Exception as error:
+        logging.exception("Error procesando %s", source)
+        summary['error'] = repr(error)
+    summary['total_s'] = round(perf_counter() - start, 3)
+    return summary
+
+
+def find_videos(paths):
+    u"""Lista los videos indicados, recorriendo los directorios.
+
+    Un mismo archivo indicado más de una vez se procesa una sola vez.
+    """
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            videos.extend(os.path.join(path, name)
+                          for name in sorted(os.listdir(path))
+                          if name.lower().endswith(VIDEO_EXTENSIONS))
+        elif os.path.isfile(path):
+            videos.append(path)
+        else:
+            logging.error("No se encontró %s", path)
+    seen = set()
+    unique = []
+    for video in videos:
+        realpath = os.path.realpath(video)
+        if realpath not in seen:
+            seen.add(realpath)
+            unique.append(video)
+    return unique
+
+
+def session_names(videos):
+    u"""Nombre de la sesión de cada video, sin repetir.
+
+    Los videos con el mismo nombre de archivo en directorios distintos (por
+    ejemplo VID_0001.mp4 de dos cámaras) se distinguen con el nombre de su
+    directorio y, si aun así coinciden, con un número.
+    """
+    basenames = [os.path.basename(video) for video in videos]
+    repeated = Counter(basenames)
+    used = set()
+    names = []
+    for video, name in zip(videos, basenames):
+        if repeated[name] > 1:
+            parent = os.path.basename(os.path.dirname(os.path.abspath(video)))
+            name = '%s-%s' % (parent, name)
+        unique, n = name, 1
+        while unique in used:
+            n += 1
+            unique = '%s-%d' % (name, n)
+        used.add(unique)
+        names.append(unique)
+    return names
+
+
+def run(config, videos, workers=1):
+    u"""Procesa los videos, uno por proceso de trabajo."""
+    # Cada video ocupa un proceso: la exploración y las figuras no se reparten
+    # además entre procesos propios.
+    config = clone(config)
+    config.set('explorer', 'workers', '1')
+    config.set('plots', 'workers', '1')
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(analyze, [config] * len(videos), videos,
+                                 session_names(videos)))
+
+
+def clone(config):
+    u"""Copia de la configuración, para no modificar la de la aplicación."""
+    copy = type(config)()
+    copy.read_dict(config)
+    return copy
+
+
+def write_summary(summaries, path):
+    with open(path, 'w', newline='') as fh:
+        writer = csv.DictWriter(fh, SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(summaries)
+
+
+def main(argv=None, config=app_config):
+    parser = argparse.ArgumentParser(
+        prog='main.py batch', description=u"Análisis de videos por lotes.")
+    parser.add_argument('paths', nargs='+', metavar='VIDEO',
+                        help=u"videos o directorios con videos")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help=u"cantidad de videos en paralelo")
+    parser.add_argument('-s', '--summary', default=None,
+                        help=u"archivo csv del resumen de tiempos")
+    args = parser.parse_args(argv)
+
+    videos = find_videos(args.paths)
+    if not videos:
+        parser.error(u"no hay videos para procesar")
+    summaries = run(config, videos, max(1, min(args.workers, len(videos))))
+    path = args.summary or os.path.join(
+        SESSION_DIR, datetime.now().strftime('lote-%Y%m%d-%H%M%S.csv'))
+    write_summary(summaries, path)
+    for summary in summaries:
+        logging.info("%(source)s: %(walks)s caminatas, %(cycles)s ciclos, "
+                     "%(total_s)s s %(error)s", summary)
+    logging.info("Resumen: %s", path)
+    return int(any(summary['error'] for summary in summaries))
@@ -21,11 +21,73 @@
 import logging
 import numpy as np
 
+from collections import namedtuple
+
+try:
+    from .profiling import profiler
+except ImportError:  # Importado como módulo suelto (ver test/).
+    from profiling import profiler
+
+
+class Parameters(namedtuple('Parameters', (
+        'n', 'segments', 'nfix', 'resampling', 'smoothing', 'smoothloops',
+        'smoothwindow', 'maxcycles', 'dtype', 'filter_by_duration',
+        'cyclemarkers', 'thresholds', 'legdistances', 'fps'))):
+    u"""Parámetros de la cinemática, leídos una sola vez de la configuración.
+
+    Los valores ya convertidos (índices de marcadores, segmentos, umbrales)
+    se comparten sin volver a consultar ni interpretar la configuración. La
+    instancia es inmutable: si la configuración cambia se construye otra.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_config(cls, config):
+        u"""Construye los parámetros a partir de la configuración."""
+        def pair(string):
+            a, b = [int(s) for s in string.split(',')]
+            return (a, b)
+
+        def cyclemarker(option):
+            m = int(config.get('kinematics', option).split('M')[1])
+            return (m * 2, m * 2 + 1)
+
+        ordersegments = config.get('schema', 'order_segments').split(',')
+        return cls(
+            n=config.getint('schema', 'n'),
+            segments=tuple((s, pair(config.get('schema', s)))
+                           for s in ordersegments),
+            nfix=config.getint('kinematics', 'nfixed'),
+            resampling=config.get('kinematics', 'resampling',
+                                  fallback='linear'),
+            smoothing=config.get('kinematics', 'smoothing', fallback='sweep'),
+            smoothloops=config.getint('kinematics', 'smoothloops',
+                                      fallback=8),
+            smoothwindow=config.getint('kinematics', 'smoothwindow',
+                                       fallback=9),
+            maxcycles=config.getint('kinematics', 'maxcycles'),
+            dtype=config.get('kinematics', 'dtype', fallback='float64'),
+            filter_by_duration=config.getboolean('kinematics',
+                                                 'filter_by_duration'),
+            cyclemarkers=(cyclemarker('cyclemarker1'),
+                          cyclemarker('cyclemarker2')),
+            thresholds=(config.getfloat('kinematics', 'leftthreshold'),
+                        config.getfloat('kinematics', 'rightthreshold')),
+            legdistances=(config.getfloat('kinematics', 'leftlength'),
+                          config.getfloat('kinematics', 'rightlength')),
+            fps=(config.getint('camera', 'fps') *
+                 config.getint('camera', 'fpscorrection')))
+
+    def segment(self, name):
+        u"""Marcadores (a, b) del segmento."""
+        return dict(self.segments)[name]
+
 
 class Schema(object):
     """docstring for Schema."""
-    def __init__(self, config):
+    def __init__(self, config, params=None):
         self.config = config
+        self.params = params or Parameters.from_config(config)
 
     def getmarker(self, markersarray, position):
         if len(markersarray.shape) == 2:
@@ -34,45 +96,56 @@ class Schema(object):
             return markersarray[:, :, (position * 2, position * 2 + 1)]
 
     def getsegment(self, markersarray, segment):
-        a, b = [int(s) for s in self.config.get('schema', segment).split(',')]
+        a, b = self.params.segment(segment)
         return (self.getmarker(markersarray, a) -
                 self.getmarker(markersarray, b))
 
 
 class Cycler(object):
 
-    def __init__(self, config):
+    def __init__(self, config, params=None):
         u"""."""
         self.config = config
+        self.params = params or Parameters.from_config(config)
         self.start()
 
     @property
     def directionvec(self):
-        return self.cyclessv[:, 2]
+        return self.cyclessv[self.active, 2]
+
+    @property
+    def activesv(self):
+        u"""Datos de los ciclos que no fueron eliminados."""
+        return self.cyclessv[self.active]
 
     def build_ids(self, justnumbers=False):
         """Construye un arreglo con las id de los ciclos."""
+        cyclessv = self.activesv
         if justnumbers:
-            return [str(c) for c in self.cyclessv[:, 0]]
+            return [str(c) for c in cyclessv[:, 0]]
         id = 'W{wid}C{cid}'
-        return [id.format(cid=c, wid=w) for c, w in self.cyclessv[:, (0, 1)]]
+        return [id.format(cid=c, wid=w) for c, w in cyclessv[:, (0, 1)]]
 
     def cycler(self, footmotion):
-        u"""Determina los componentes del ciclo."""
-        strike = []
-        prevframe, nextframe = footmotion[:-1], footmotion[1:]
-        for i, (prev, next) in enumerate(zip(prevframe, nextframe)):
-            if prev and not next:
-                strike.append(i+1)
-            if not prev and next:
-                toe_off = i+1
-            if len(strike) == 2:
-                yield (strike[0], toe_off, strike[1])
-                self.counter += 1
-                strike.pop(0)
+        u"""Determina los componentes de los ciclos.
+
+        Los contactos son los flancos de bajada del vector de movimiento del
+        pie y los despegues los de subida. Devuelve un arreglo (ciclos, 3) con
+        los cuadros de contacto, despegue y contacto siguiente de cada ciclo.
+        """
+        edges = np.diff(footmotion.astype(np.int8))
+        strike = np.flatnonzero(edges == -1) + 1
+        toe_off = np.flatnonzero(edges == 1) + 1
+        # Entre dos contactos consecutivos hay un único despegue.
+        toe_off = toe_off[np.searchsorted(toe_off, strike[:-1])]
+        return np.array((strike[:-1], toe_off, strike[1:])).transpose()
 
     def find_cycles(self, walk, footindexes, lrthreshold):
         u"""Busca ciclos dentro de la caminata."""
+        with profiler.stage('find_cycles', frames=walk.markers.shape[0]) as stage:
+            stage.cycles = self._find_cycles(walk, footindexes, lrthreshold)
+
+    def _find_cycles(self, walk, footindexes, lrthreshold):
         rear, front = footindexes
         footmarkers = walk.markers[:, rear], walk.markers[:, front]
         footvelocity = self.soft_foot_velocity(np.abs(np.diff(footmarkers, axis=1).mean(2)))
@@ -80,100 +153,224 @@ class Cycler(object):
         footmotion = np.logical_and(*(footvelocity >= lrthreshold[walk.dir]))
         self.movement.append((walk.id, footvelocity, footmotion))
 
-        for (c1, c2, c3) in self.cycler(footmotion):
-            self.cyclessv[self.counter] = np.hstack(
-                (self.counter, walk.id, walk.dir, (c1, c2, c3)))
-            self.cyclesmk[self.counter] = self.resize_markers_array(walk.markers[c1:c3, :])
+        cycles = self.cycler(footmotion)
+        ncycles = cycles.shape[0]
+        self.reserve(self.counter + ncycles)
+        ids = np.arange(self.counter, self.counter + ncycles)
+        self._sv[ids, 0] = ids
+        self._sv[ids, 1] = walk.id
+        self._sv[ids, 2] = walk.dir
+        self._sv[ids, 3:] = cycles
+        self.resize_cycles(walk.markers, cycles[:, 0], cycles[:, 2],
+                           out=self._mk[self.counter: self.counter + ncycles])
+        self.counter += ncycles
+        self.cyclessv = self._sv[:self.counter]
+        self.cyclesmk = self._mk[:self.counter]
+        self.active = np.ones(self.counter, dtype=bool)
+        return ncycles
+
+    def reserve(self, ncycles):
+        u"""Asegura lugar para ncycles ciclos en los contenedores.
+
+        Si no alcanza, la capacidad se duplica (o se lleva a ncycles si es
+        mayor) y se copian los ciclos ya encontrados.
+        """
+        capacity = self._sv.shape[0]
+        if ncycles <= capacity:
+            return
+        capacity = max(ncycles, capacity * 2)
+        sv = np.zeros((capacity,) + self._sv.shape[1:], dtype=self._sv.dtype)
+        mk = np.zeros((capacity,) + self._mk.shape[1:], dtype=self._mk.dtype)
+        sv[:self.counter] = self._sv[:self.counter]
+        mk[:self.counter] = self._mk[:self.counter]
+        self._sv, self._mk = sv, mk
+        logging.debug("Capacidad de ciclos: %d", capacity)
 
     def remove(self, toremoveids):
-        cycleids = self.build_ids(justnumbers=True)
-        index = []
-        for cid in toremoveids:
-            if cid in cycleids:
-                index.append(cycleids.index(cid))
-        if index:
+        u"""Elimina ciclos por su id.
+
+        Los ciclos sólo se marcan como inactivos, sin copiar los contenedores.
+        Devuelve las filas de los ciclos eliminados.
+        """
+        cycleids = self.cyclessv[:, 0].astype(str)
+        index = np.flatnonzero(self.active & np.isin(cycleids, toremoveids))
+        if index.size:
             logging.info("removed")
-            self.cyclessv = np.delete(self.cyclessv, index, axis=0)
-            self.cyclesmk = np.delete(self.cyclesmk, index, axis=0)
+            self.active[index] = False
+        return index
 
     def resize_markers_array(self, sample):
         """Modifica el arreglo en el eje de la duración de cuadros."""
-        nrows, ncols = sample.shape
-        xarange = np.arange(nrows)
-        newsample = np.ndarray((self.nfix, ncols))
-        newdomain = np.linspace(0, nrows, self.nfix)
-        for c, values in enumerate(sample.transpose()):
-            newsample[:, c] = np.interp(newdomain, xarange, values)
-        return newsample
-
-    def soft_foot_velocity(self, array, loops=8):
-        u"""Suaviza las curvas de velocidad de los marcadores de pie."""
-        index = np.arange(array.shape[1])
+        nrows, __ = sample.shape
+        return self.resize_cycles(sample, np.array((0,)), np.array((nrows,)))[0]
+
+    def resize_cycles(self, markers, starts, stops, out=None):
+        u"""Lleva los ciclos [starts, stops) de la caminata a nfix cuadros.
+
+        El dominio de cada ciclo va de 0 a su duración, como en
+        np.interp(np.linspace(0, duración, nfix), ...), y todos los ciclos y
+        columnas se interpolan a la vez. Con [kinematics] resampling = spline
+        la interpolación es cúbica (Catmull-Rom) en lugar de lineal. Si se
+        indica out, el resultado se escribe directamente en ese arreglo.
+        """
+        lengths = stops - starts
+        last = (lengths - 1)[:, np.newaxis]
+        # np.linspace(0, length, nfix) para cada ciclo.
+        domain = np.arange(self.nfix) * (lengths / (self.nfix - 1))[:, np.newaxis]
+        domain[:, -1] = lengths
+        domain = np.minimum(domain, last)
+        lower = np.floor(domain).astype(np.intp)
+        fraction = (domain - lower)[:, :, np.newaxis]
+        starts = starts[:, np.newaxis]
+        if out is None:
+            out = np.ndarray(domain.shape + markers.shape[1:])
+
+        def sample(offset):
+            index = np.clip(lower + offset, 0, last)
+            return markers[starts + index].astype(np.float64)
+
+        if self.resampling == 'spline':
+            p0, p1, p2, p3 = [sample(offset) for offset in (-1, 0, 1, 2)]
+            out[:] = p1 + 0.5 * fraction * (
+                (p2 - p0) + fraction * ((2 * p0 - 5 * p1 + 4 * p2 - p3) +
+                                        fraction * (3 * (p1 - p2) + p3 - p0)))
+        else:
+            m0, m1 = sample(0), sample(1)
+            np.subtract(m1, m0, out=out)
+            out *= fraction
+            out += m0
+        return out
+
+    def soft_foot_velocity(self, array, loops=None):
+        u"""Suaviza las curvas de velocidad de los marcadores de pie.
+
+        El método se elige con [kinematics] smoothing:
+        sweep: en cada pasada, y en orden, cada muestra interior se reemplaza
+            por el promedio de la anterior (ya suavizada) y la siguiente.
+        convolution: en cada pasada, cada muestra interior se reemplaza por el
+            promedio ponderado (1/4, 1/2, 1/4) con sus vecinas originales.
+        savgol: filtro de Savitzky-Golay de segundo orden, en una sola pasada,
+            con una ventana de [kinematics] smoothwindow muestras.
+        """
+        loops = self.smoothloops if loops is None else loops
+        if array.shape[1] < 3:
+            return array
+        if self.smoothing == 'convolution':
+            kernel = np.array((.25, .5, .25))
+            for __ in range(loops):
+                for row in array:
+                    row[1:-1] = np.convolve(row, kernel, 'valid')
+        elif self.smoothing == 'savgol':
+            half = min(self.smoothwindow, array.shape[1]) // 2
+            if half:
+                x = np.arange(-half, half + 1)
+                kernel = np.linalg.pinv(np.vander(x, 3, increasing=True))[0]
+                for row in array:
+                    row[half:-half] = np.convolve(row, kernel[::-1], 'valid')
+        else:
+            self.sweep(array, loops)
+        return array
+
+    def sweep(self, array, loops):
+        u"""Barridos de promedio de vecinos, sobre cada fila del arreglo.
+
+        El barrido y[j] = (y[j-1] + x[j+1]) / 2 se resuelve de forma cerrada:
+        y[j] = x[0] / 2**j + suma_k x[j+1-k] / 2**(k+1), es decir, una
+        convolución de x con un núcleo geométrico. Los términos de más de 64
+        muestras de distancia están por debajo de la precisión de float64.
+        """
+        n = array.shape[1]
+        kernel = 0.5 ** np.arange(1, min(n - 2, 64) + 1)
+        decay = 0.5 ** np.arange(1, n - 1)
         for __ in range(loops):
-            for i, j, k in zip(index[:-1], index[1:-1], index[2:]):
-                array[:, j] = (array[:, i] + array[:, k]) / 2
+            for row in array:
+                row[1:-1] = np.convolve(row[2:], kernel)[:n - 2] + decay * row[0]
         return array
 
-    def filter_by_duration(self):
-        """Devuelve los datos de ciclados filtrados por duración de ciclo."""
+    def duration_mask(self):
+        u"""Máscara de los ciclos que superan el filtro de duración."""
         duration = np.diff(self.cyclessv[:, (-3, -1)].transpose(), axis=0)
         dmean, dstd = np.mean(duration), np.std(duration)
         coeff = dmean if ((dstd / dmean) > 0.05) else (dmean - (2 * dstd))
-        mask = (duration > coeff).flatten()
+        return (duration > coeff).flatten()
+
+    def filter_by_duration(self):
+        """Devuelve los datos de ciclados filtrados por duración de ciclo."""
+        mask = self.duration_mask()
         return (self.cyclessv[mask], self.cyclesmk[mask])
 
     def start(self):
         u"""Inicializa los contenedores y los valores de usuario."""
         self.counter = 0
-        self.nfix = self.config.getint("kinematics", "nfixed")
-        nmarkers = self.config.getint('schema', 'n') * 2
-        maxcycles = self.config.getint("kinematics", "maxcycles")
-        self.cyclessv = np.ndarray((maxcycles, 6), dtype=np.int32)
-        self.cyclesmk = np.ndarray((maxcycles, self.nfix, nmarkers))
+        params = self.params
+        self.nfix = params.nfix
+        self.resampling = params.resampling
+        self.smoothing = params.smoothing
+        self.smoothloops = params.smoothloops
+        self.smoothwindow = params.smoothwindow
+        nmarkers = params.n * 2
+        # maxcycles es la capacidad inicial; los contenedores crecen si hace
+        # falta (ver reserve).
+        capacity = max(params.maxcycles, 1)
+        self._sv = np.zeros((capacity, 6), dtype=np.int32)
+        self._mk = np.zeros((capacity, self.nfix, nmarkers), dtype=params.dtype)
+        self.cyclessv = self._sv[:0]
+        self.cyclesmk = self._mk[:0]
+        self.active = np.ones(0, dtype=bool)
         self.movement = []  # NOTE: Este es un parche para plotear los valores
         # de velocidad y movimiento resultado del cyclado.
 
     def stop(self):
-        """Finaliza los contenedores."""
-        self.cyclessv = self.cyclessv[:self.counter]
-        self.cyclesmk = self.cyclesmk[:self.counter]
-        if self.config.getboolean("kinematics", "filter_by_duration") is True:
-            self.cyclessv, self.cyclesmk = self.filter_by_duration()
+        u"""Finaliza los contenedores.
+
+        Devuelve la máscara de los ciclos encontrados que se conservan, para
+        aplicarla a los resultados que ya se hayan calculado sobre ellos.
+        """
+        self.cyclessv = self._sv[:self.counter]
+        self.cyclesmk = self._mk[:self.counter]
+        kept = np.ones(self.counter, dtype=bool)
+        if self.params.filter_by_duration is True:
+            kept = self.duration_mask()
+            self.cyclessv, self.cyclesmk = self.cyclessv[kept], self.cyclesmk[kept]
             logging.info("Filtrando por duración de ciclos")
+        self.active = np.ones(self.cyclessv.shape[0], dtype=bool)
+        return kept
 
 
 class Kinematics(object):
 
     def __init__(self, config):
         self.config = config
+        self.params = Parameters.from_config(config)
         self.start()
 
     @property
     def cyclemarkers(self):
-        cm1 = int(self.config.get('kinematics', 'cyclemarker1').split('M')[1])
-        cm2 = int(self.config.get('kinematics', 'cyclemarker2').split('M')[1])
-        return np.array(((cm1*2, cm1*2 +1), (cm2*2, cm2*2 +1)))
+        return np.array(self.params.cyclemarkers)
 
     @property
     def footvelocitythreshold(self):
-        lth = self.config.getfloat('kinematics', 'leftthreshold')
-        rth = self.config.getfloat('kinematics', 'rightthreshold')
-        return (lth, rth)
-
-    def build_segments(self):
-        # NOTE: MODIFICAR CON LA CLASE SCHEMA
-        ix = np.arange(self.config.getint('schema', 'n')) * 2
-        iy = np.arange(self.config.getint('schema', 'n')) * 2 + 1
-        indexes = np.array((ix, iy)).transpose()
-
-        ncycles, ndata, nmarkers = self.cycler.cyclesmk.shape
-        ordersegments = self.config.get('schema', 'order_segments').split(',')
-        segments = np.ndarray((ncycles, ndata, len(ordersegments) * 2))
-        mk = self.cycler.cyclesmk
-        for i, s in enumerate(ordersegments):
+        return self.params.thresholds
+
+    def invalidate(self):
+        u"""Vuelve a leer los parámetros luego de un cambio de configuración.
+
+        Si los parámetros cambiaron, los resultados quedan desactualizados y
+        el próximo cycle_walks vuelve a procesar todas las caminatas.
+        """
+        params = Parameters.from_config(self.config)
+        if params != self.params:
+            self.params = params
+            self.stale = True
+
+    def build_segments(self, mk=None):
+        if mk is None:
+            mk = self.cycler.cyclesmk
+        ncycles, ndata, nmarkers = mk.shape
+        segments = np.ndarray((ncycles, ndata, len(self.params.segments) * 2))
+        for i, (__, (a, b)) in enumerate(self.params.segments):
             place = (i*2, i*2+1)
-            a, b = [int(m) for m in self.config.get('schema', s).split(',')]
-            segments[:, :, place] = mk[:, :, indexes[b]] - mk[:, :, indexes[a]]
+            segments[:, :, place] = mk[:, :, (b*2, b*2+1)] - mk[:, :, (a*2, a*2+1)]
         return segments
 
     def calculate_angles(self):
@@ -186,36 +383,133 @@ class Kinematics(object):
         legmarkers = self.cycler.cyclesmk[:, :, 6:10]
         return self.stp.calculate(self.cycler.cyclessv, self.cycler.cyclesmk)
 
+    def push_walk(self, walk):
+        u"""Procesa una caminata en cuanto se cierra.
+
+        Encuentra los marcadores y los ciclos de la caminata y calcula los
+        parámetros espaciotemporales y los ángulos de los ciclos nuevos, de
+        manera que al terminar el video sólo resta unir los resultados (ver
+        finish). Las caminatas que ya se procesaron se ignoran.
+        """
+        if walk in self.pushed:
+            return
+        self.pushed.add(walk)
+        try:
+            walk.find_markers()
+            first = self.cycler.counter
+            self.cycler.find_cycles(walk, self.cyclemarkers,
+                                    self.footvelocitythreshold)
+            sv = self.cycler.cyclessv[first:]
+            mk = self.cycler.cyclesmk[first:]
+            self.partial.append((self.stp.calculate(sv, mk),
+                                 self.angles.calculate(
+                                     self.build_segments(mk), sv[:, 2])))
+        except Exception:
+            # Los contenedores pueden haber quedado a medias.
+            self.stale = True
+            raise
+
+    def finish(self):
+        u"""Cierra el ciclado y une los resultados de cada caminata."""
+        if self.results is not None:
+            return
+        kept = self.cycler.stop()
+        if self.partial:
+            stp = np.concatenate([p[0] for p in self.partial])
+            joints = np.concatenate([p[1] for p in self.partial], axis=1)
+        else:
+            stp = np.zeros((0, 9))
+            joints = np.zeros((3, 0, self.cycler.nfix))
+        self.results = (stp[kept], joints[:, kept])
+        self.partial = []
+        self.accumulate(np.flatnonzero(self.cycler.active), 1)
+
+    def accumulate(self, rows, sign):
+        u"""Suma (sign=1) o resta (sign=-1) ciclos de los promedios por lado.
+
+        Se llevan las sumas y la cantidad de valores que no son nan, como en
+        np.nanmean, de manera que eliminar un ciclo no obliga a recalcular
+        los promedios de todos los demás.
+        """
+        stp, joints = self.results
+        direction = self.cycler.cyclessv[rows, 2]
+        for side in (0, 1):
+            srows = rows[direction == side]
+            for values, sums, counts in ((stp[srows], self.stpsum, self.stpcount),
+                                         (joints[:, srows].swapaxes(0, 1),
+                                          self.jointsum, self.jointcount)):
+                sums[side] += sign * np.nansum(values, axis=0)
+                counts[side] += sign * np.count_nonzero(~np.isnan(values), axis=0)
+
+    def summary(self):
+        u"""Promedios por lado (izquierdo, derecho) de los ciclos activos.
+
+        Devuelve los parámetros espaciotemporales medios (2, 9), las curvas
+        articulares medias (2, 3, nfix) y el rango de movimiento (3, 4), con
+        el mínimo y el máximo de la curva media de cadera, rodilla y tobillo
+        de cada lado.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stp = self.stpsum / self.stpcount
+            joints = self.jointsum / self.jointcount
+        rom = np.empty((3, 4))
+        rom[:, 0::2] = joints.min(axis=-1).transpose()
+        rom[:, 1::2] = joints.max(axis=-1).transpose()
+        return stp, joints, rom
+
     def cycle_walks(self, walks):
-        cyclemarkers = self.cyclemarkers
-        lrthreshold = self.footvelocitythreshold
+        u"""Procesa las caminatas que falten y une los resultados.
+
+        Si los resultados están desactualizados (ver invalidate), o incluyen
+        caminatas que no están en walks (por ejemplo, de otro video), se
+        vuelve a empezar con todas las caminatas.
+        """
+        if self.stale or not self.pushed.issubset(walks):
+            self.start()
         for walk in walks:
-            self.cycler.find_cycles(walk, cyclemarkers, lrthreshold)
-        self.cycler.stop()
+            self.push_walk(walk)
+        self.finish()
 
     def delete_cycles(self, cycles, ret=False):
-        self.cycler.remove(cycles)
+        index = self.cycler.remove(cycles)
+        if index.size and self.results is not None:
+            self.accumulate(index, -1)
         if ret:
             return self.to_plot()
 
     def start(self):
-        self.cycler = Cycler(self.config)
+        self.cycler = Cycler(self.config, self.params)
         self.angles = Angles()
-        self.stp = SpatioTemporal(self.config)
+        self.stp = SpatioTemporal(self.config, self.params)
+        self.pushed = set()
+        self.partial = []
+        self.results = None
+        self.stale = False
+        nfix = self.cycler.nfix
+        self.stpsum, self.stpcount = np.zeros((2, 9)), np.zeros((2, 9), int)
+        self.jointsum = np.zeros((2, 3, nfix))
+        self.jointcount = np.zeros((2, 3, nfix), int)
 
     def to_plot(self):
         ids = np.array(self.cycler.build_ids())
-        stp = self.calculate_stp()
         dir = self.cycler.directionvec
-        hip, knee, ankle = self.calculate_angles()
+        active = self.cycler.active
+        if self.results is None:
+            stp = self.calculate_stp()[active]
+            hip, knee, ankle = self.calculate_angles()[:, active]
+        else:
+            stp, joints = self.results
+            stp = stp[active]
+            hip, knee, ankle = joints[:, active]
         return (ids, dir, stp, hip, knee, ankle)
 
 
 class SpatioTemporal(object):
 
-    def __init__(self, config):
+    def __init__(self, config, params=None):
         self.config = config
-        self.schema = Schema(config)
+        self.params = params or Parameters.from_config(config)
+        self.schema = Schema(config, self.params)
 
     def _scale(self, markers, legdistance):
         """Calcula la escala entre pixeles y metros.
@@ -237,8 +531,7 @@ class SpatioTemporal(object):
         return (realdistance / pixeldistance).mean(axis=-1)
 
     def _legdistance(self, direction):
-        ldis = self.config.getfloat('kinematics', 'leftlength')
-        rdis = self.config.getfloat('kinematics', 'rightlength')
+        ldis, rdis = self.params.legdistances
         distances = np.ndarray((direction.size))
         distances[direction == 0] = ldis
         distances[direction == 1] = rdis
@@ -267,15 +560,17 @@ class SpatioTemporal(object):
     def calculate(self, cyclessv, cyclesmk):
         u"""Obtine los parámetros espaciotemporales del ciclo."""
         ncycles, __ = cyclessv.shape
-        stp = np.ndarray((ncycles, 9))
+        with profiler.stage('spatiotemporal', cycles=ncycles):
+            return self._calculate(cyclessv, cyclesmk, ncycles)
+
+    def _calculate(self, cyclessv, cyclesmk, ncycles):
+        stp = np.zeros((ncycles, 9))
 
         realdistances = self._legdistance(cyclessv[:, 2])
         pxtom = self._scale(cyclesmk, realdistances)
         stp[:, 6] = self.stride(cyclesmk, pxtom)
 
-        fps = self.config.getint('camera', 'fps')
-        correction = self.config.getint('camera', 'fpscorrection')
-        stp[:, 1: 6] = np.array(self.temporal(fps*correction, cyclessv)).transpose()
+        stp[:, 1: 6] = np.array(self.temporal(self.params.fps, cyclessv)).transpose()
 
         stp[:, 7:] = np.array(self.velocity(stp[:, 1], stp[:, 6])).transpose()
         return stp
@@ -284,22 +579,25 @@ class SpatioTemporal(object):
 class Angles(object):
 
     def angle(self, A, B):
-        """Calcula el ángulo entre dos vectores."""
-        ncycles, nrows, ncols = A.shape
-        degrees = np.ndarray((ncycles, nrows))
-        for i, (a, b) in enumerate(zip(A, B)):
-            na = np.linalg.norm(A[i], axis=1)
-            nb = np.linalg.norm(B[i], axis=1)
-            ab = a.dot(b.transpose()).diagonal()
-            degrees[i] = np.degrees(np.arccos(ab / (na * nb)))
-        return degrees
-
-    def canonicalX(self, direction):
+        u"""Calcula el ángulo entre dos vectores.
+
+        A y B son arreglos (ciclos, cuadros, 2); el ángulo de cada par de
+        vectores se obtiene como arctan2(|a x b|, a . b), para todos los
+        ciclos a la vez y sin perder precisión cerca de 0 y 180 grados. Si
+        alguno de los vectores es nulo el ángulo es nan, como con arccos, para
+        que los promedios lo ignoren.
+        """
+        dot = np.einsum('ijk,ijk->ij', A, B)
+        cross = A[:, :, 0] * B[:, :, 1] - A[:, :, 1] * B[:, :, 0]
+        null = (np.einsum('ijk,ijk->ij', A, A) *
+                np.einsum('ijk,ijk->ij', B, B)) == 0
+        return np.where(null, np.nan,
+                        np.degrees(np.arctan2(np.abs(cross), dot)))
+
+    def canonicalX(self, direction, nrows=100):
         u"""arreglo de vectores unitarios."""
-        sign = direction.copy().reshape(direction.size, 1)
-        canonical = np.zeros((direction.size, 100, 2))
-        sign[direction == 0] = -1
-        canonical[:, :, 0] = sign
+        canonical = np.zeros((direction.size, nrows, 2))
+        canonical[:, :, 0] = np.where(direction == 0, -1, direction)[:, np.newaxis]
         return canonical
 
     def hip_joint(self, tight, canonical):
@@ -315,8 +613,11 @@ class Angles(object):
         return self.angle(leg, foot) - 90
 
     def calculate(self, segments, direction):
-        canonical = self.canonicalX(direction)
-        # NOTE: ESTO ESTA BASTANE MAL, TANTO LLAMAR A CONFIG PARA AHORA HACERLO HARDCORE
+        with profiler.stage('angles', cycles=direction.size):
+            return self._calculate(segments, direction)
+
+    def _calculate(self, segments, direction):
+        canonical = self.canonicalX(direction, segments.shape[1])
         hip = self.hip_joint(segments[:, :, (0, 1)], canonical)
         knee = self.knee_joint(segments[:, :, (0, 1)], segments[:, :, (2, 3)], canonical)
         ankle = self.ankle_joint(segments[:, :, (2, 3)], segments[:, :, (4, 5)])
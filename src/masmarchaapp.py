@@ -31,10 +31,11 @@ from kivy.uix.gridlayout import GridLayout
 from kivy.uix.floatlayout import FloatLayout
 from kivy.uix.popup import Popup
 
-from .video import Explorer, Pics
-from .settings import app_config, new_session, CONFIG_PATH
+from .video import Explorer
+from .settings import app_config, CONFIG_PATH
 from .kinematics import Kinematics
-from .representation import WalkPlot, SpatioTemporal, AnglePlot, ROM
+from .session import set_session, write_outputs
+from .profiling import profiler
 
 
 Window.size = (1200, 800)
@@ -53,12 +54,10 @@ class MasMarchaApp(App):
         self.config.set(*args)
         with open(CONFIG_PATH, "w") as fh:
             self.config.write(fh)
+        self.kinematics.invalidate()
 
     def new_session(self, sessionname):
-        session, walks, pics = new_session(sessionname)
-        self.config.set('current', 'session', session)
-        self.config.set('current', 'walks', walks)
-        self.config.set('current', 'pics', pics)
+        set_session(self.config, sessionname)
 
 
 class MainFrame(GridLayout):
@@ -100,6 +99,7 @@ class VidControl(GridLayout):
             self.new_session(value)  # NOTE: esta implementación hace innecesaria "sourcefile"
             self.sourcefile = value
             self.explorer.open_file(value)
+            self.kinematics.start()
             self.progressbar.max = self.explorer.nframes
 
     def progress(self, pqueue):
@@ -116,16 +116,20 @@ class VidControl(GridLayout):
         self.progressbar.value = 0
 
     def process_walks(self):
-        for walk in self.explorer.walks:
-            walk.find_markers()
+        # Las caminatas cerradas ya se procesaron durante la búsqueda; acá se
+        # completa la última, si el video terminó en medio de una.
+        self.kinematics.cycle_walks(self.explorer.walks)
 
     def find_walks(self):
         u"""Lanza el proceso de procesamiento del video."""
         if self.sourcefile is None:
             return
         self.progressbar.value = 10
+        profiler.configure(self.config)
+        self.kinematics.start()
         q = Queue()
-        t1 = Thread(target=self.explorer.find_walks, args=(q,), daemon=True)
+        t1 = Thread(target=self.explorer.find_walks,
+                    args=(q, self.kinematics.push_walk), daemon=True)
         t2 = Thread(target=self.progress, args=(q,), daemon=True)
         t1.start()
         t2.start()
@@ -158,9 +162,11 @@ class PlotsControl(GridLayout):
     cids = []
 
     def get_params(self):
-        self.kinematics.start()
+        # Los resultados se calculan a medida que se encuentran las caminatas;
+        # sólo se completan las que falten, salvo que hayan cambiado los
+        # parámetros: en ese caso se vuelven a procesar todas.
+        self.kinematics.invalidate()
         self.kinematics.cycle_walks(self.explorer.walks)
-        self.kinematics.build_segments()
 
     def select(self):
         self.cids = [s.strip() for s in self.ids.toremove.text.split(',')]
@@ -170,87 +176,10 @@ class PlotsControl(GridLayout):
         self.plot()
 
     def plot(self, getparams=False):
-        # NOTE:  TODA ESTA SECCIÓN TIENE UN MAL DISEÑO.
-        # POR AHORA TODAS LAS IMÁGENES QUE SE CREAN VAN A SALR DE ACÁ
-        # PERO ES NECESARIO REDISEÑAR EL PROCESO.
         if not self.explorer.source:
             return
-        import numpy as np  # NOTE: quitar cuando se formalice la tabla rom
-        destpath = self.config.get('current', 'session')
-
         if getparams:
             self.get_params()
 
-        # NOTE: resultados del ciclado.
-        walks = WalkPlot(self.config)
-        # NOTE: por ahora se obtienen del cycler
-        walks.plot(self.kinematics.cycler, self.config.get('current', 'walks'))
-
-
-        # Pics de los cyclos.
-        pics = Pics(self.config)
-        pics.open(self.explorer.source)
-        pics.make_pics(self.kinematics.cycler.cyclessv, self.explorer.walks)
-
-
-        labels, direction, stp, hip, knee, ankle = self.kinematics.to_plot()
-        # Por ahora no se están aceptando en la tabla los datos de tiempos de
-        # fase
-        stp = stp[:, [1, 4, 5, 6, 7, 8]]
-
-        # parámetros espacio temporales
-        leftstp = stp[direction == 0].mean(axis=0).round(1)
-        rightstp = stp[direction == 1].mean(axis=0).round(1)
-        tablestp = SpatioTemporal(self.config, "Parámetros espacio-temporales")
-        tablestp.build(params=np.array((leftstp, rightstp)).transpose())
-        tablestp.save(destpath)
-        # cinemática ángulos
-        angles = AnglePlot('Cinematica', config=self.config)
-        angles.add_joint('cadera', direction, labels, hip, stp[:, 1])
-        angles.add_joint('rodilla', direction, labels, knee, stp[:, 1])
-        angles.add_joint('tobillo', direction, labels, ankle, stp[:, 1])
-        angles.plot(putlegends=True)
-        angles.save(destpath)
-
-        # cadera
-        h = AnglePlot('Cadera', config=self.config)
-        h.add_joint('hip', direction, labels, hip, stp[:, 1])
-        h.plot(summary=True)
-        h.save(destpath)
-
-        # rodilla
-        k = AnglePlot('Rodilla', config=self.config)
-        k.add_joint('knee', direction, labels, knee, stp[:, 1])
-        k.plot(summary=True)
-        k.save(destpath)
-
-        # tobillo
-        a = AnglePlot('Tobillo', config=self.config)
-        a.add_joint('ankle', direction, labels, ankle, stp[:, 1])
-        a.plot(summary=True)
-        a.save(destpath)
-
-        # ROM
-        maxlh = np.max(np.nanmean(hip[direction == 0], axis=0))
-        minlh = np.min(np.nanmean(hip[direction == 0], axis=0))
-        maxrh = np.max(np.nanmean(hip[direction == 1], axis=0))
-        minrh = np.min(np.nanmean(hip[direction == 1], axis=0))
-
-        maxlk = np.max(np.nanmean(knee[direction == 0], axis=0))
-        minlk = np.min(np.nanmean(knee[direction == 0], axis=0))
-        maxrk = np.max(np.nanmean(knee[direction == 1], axis=0))
-        minrk = np.min(np.nanmean(knee[direction == 1], axis=0))
-
-        maxla = np.max(np.nanmean(ankle[direction == 0], axis=0))
-        minla = np.min(np.nanmean(ankle[direction == 0], axis=0))
-        maxra = np.max(np.nanmean(ankle[direction == 1], axis=0))
-        minra = np.min(np.nanmean(ankle[direction == 1], axis=0))
-
-        rom = np.array((
-            ((minlh.round(1), maxlh.round(1), minrh.round(1), maxrh.round(1)),
-             (minlk.round(1), maxlk.round(1), minrk.round(1), maxrk.round(1)),
-             (minla.round(1), maxla.round(1), minra.round(1), maxra.round(1))))
-        )
-        romtable = ROM(self.config, "Rango de movimiento")
-        romtable.build(rom)
-        romtable.save(destpath)
+        write_outputs(self.config, self.explorer.source, self.explorer.walks,
+                      self.kinematics)
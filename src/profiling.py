@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+u"""Medición de tiempos por etapa del procesamiento.
+
+Las etapas se miden con profiler.stage(nombre), que sólo registra algo si la
+medición está habilitada con [profiling] enabled = True o con la variable de
+entorno MASMARCHA_PROFILE. El informe se guarda como json en la sesión.
+"""
+
+# Copyright (C) 2019  Mariano Ramis
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import logging
+import cProfile
+from time import perf_counter
+from threading import Lock
+from contextlib import nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows.
+    resource = None
+
+
+# MASMARCHA_PROFILE=1 habilita la medición; si el valor es el nombre de una
+# etapa, además se captura esa etapa con cProfile.
+ENVIRON = 'MASMARCHA_PROFILE'
+
+REPORT_NAME = 'profiling.json'
+
+
+class Stage(object):
+    u"""Medición de una llamada a una etapa.
+
+    Dentro del bloque with se pueden asignar frames y cycles, la cantidad de
+    cuadros y de ciclos procesados, si no se conocen de antemano.
+    """
+
+    def __init__(self, profiler, name, frames, cycles):
+        self.profiler = profiler
+        self.name = name
+        self.frames = frames
+        self.cycles = cycles
+
+    def __enter__(self):
+        self.capture = self.profiler.capture(self.name)
+        if self.capture is not None:
+            self.capture.enable()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = perf_counter() - self.start
+        if self.capture is not None:
+            self.capture.disable()
+        self.profiler.add(self.name, seconds, self.frames, self.cycles)
+        return False
+
+
+class Profiler(object):
+    u"""Acumula el tiempo, las llamadas, los cuadros y los ciclos por etapa."""
+
+    def __init__(self):
+        self.enabled = False
+        self.cprofile = ''
+        self.start()
+
+    def configure(self, config):
+        u"""Habilita la medición según la configuración y el entorno."""
+        environ = os.environ.get(ENVIRON, '').strip()
+        self.enabled = (config.getboolean('profiling', 'enabled',
+                                          fallback=False) or
+                        environ.lower() not in ('', '0', 'false', 'no'))
+        self.cprofile = config.get('profiling', 'cprofile', fallback='')
+        if environ.lower() not in ('', '0', '1', 'false', 'no', 'true', 'yes'):
+            self.cprofile = environ
+        self.start()
+
+    def start(self):
+        u"""Descarta las mediciones anteriores."""
+        self.stages = {}
+        self.profile = None
+        self.began = perf_counter()
+        self._lock = Lock()
+
+    def stage(self, name, frames=0, cycles=0):
+        u"""Bloque with que mide una llamada a la etapa name."""
+        if not self.enabled:
+            return nullcontext(Stage(self, name, frames, cycles))
+        return Stage(self, name, frames, cycles)
+
+    def capture(self, name):
+        if name != self.cprofile:
+            return None
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+        return self.profile
+
+    def add(self, name, seconds, frames=0, cycles=0):
+        with self._lock:
+            stage = self.stages.setdefault(
+                name, {'seconds': 0., 'calls': 0, 'frames': 0, 'cycles': 0})
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+            stage['frames'] += frames
+            stage['cycles'] += cycles
+
+    def merge(self, stages):
+        u"""Suma las mediciones de otro proceso (ver Profiler.stages)."""
+        for name, stage in stages.items():
+            with self._lock:
+                total = self.stages.setdefault(
+                    name, {'seconds': 0., 'calls': 0, 'frames': 0, 'cycles': 0})
+                for key, value in stage.items():
+                    total[key] += value
+
+    def peak_memory(self):
+        u"""Memoria máxima (MB) del proceso y de sus procesos hijos."""
+        if resource is None:
+            return None, None
+        # ru_maxrss está en kilobytes en Linux.
+        return tuple(round(resource.getrusage(who).ru_maxrss / 1024., 1)
+                     for who in (resource.RUSAGE_SELF,
+                                 resource.RUSAGE_CHILDREN))
+
+    def report(self):
+        u"""Informe de las etapas, con cuadros y ciclos por segundo."""
+        stages = {}
+        for name, stage in sorted(self.stages.items()):
+            stage = dict(stage)
+            seconds = stage['seconds']
+            for key, rate in (('frames', 'frames_per_s'),
+                              ('cycles', 'cycles_per_s')):
+                stage[rate] = (round(stage[key] / seconds, 1)
+                               if stage[key] and seconds else None)
+            stage['seconds'] = round(seconds, 4)
+            stages[name] = stage
+        memory, children = self.peak_memory()
+        return {'elapsed_s': round(perf_counter() - self.began, 4),
+                'peak_memory_mb': memory,
+                'peak_memory_children_mb': children,
+                'cprofile': self.cprofile or None,
+                'stages': stages}
+
+    def save(self, destpath):
+        u"""Guarda el informe (y la captura de cProfile) en destpath."""
+        if not self.enabled:
+            return None
+        path = os.path.join(destpath, REPORT_NAME)
+        with open(path, 'w') as fh:
+            json.dump(self.report(), fh, indent=2)
+        if self.profile is not None:
+            self.profile.dump_stats(
+                os.path.join(destpath, 'profiling-%s.prof' % self.cprofile))
+        logging.info("Informe de tiempos: %s", path)
+        return path
+
+
+# Medición del proceso actual.
+profiler = Profiler()
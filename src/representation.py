@@ -27,23 +27,178 @@ formato de archivo de dibujo.
 
 
 import os
+import csv
+import html
+import json
 import logging
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 
-from matplotlib.lines import Line2D
+from matplotlib.collections import LineCollection
+
+try:
+    from .profiling import profiler
+except ImportError:  # Importado como módulo suelto (ver test/).
+    from profiling import profiler
 
 matplotlib.use("Agg")
 
 
+class NormalData(object):
+    u"""Datos normales de referencia (normal/*.csv), compartidos en el proceso.
+
+    Los archivos se leen una sola vez por directorio y se vuelven a leer sólo
+    si alguno cambia (nombre, tamaño o fecha de modificación). Al leer los csv
+    se guarda además una copia binaria, normal.npz, que se usa en lugar de
+    los csv mientras éstos no cambien. Los arreglos son de sólo lectura.
+    """
+    _registries = {}
+    compiled = 'normal.npz'
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        self.stamp = None
+        self.data = {}
+
+    @classmethod
+    def from_config(cls, config):
+        dirpath = config.get("paths", "normal")
+        if dirpath not in cls._registries:
+            cls._registries[dirpath] = cls(dirpath)
+        return cls._registries[dirpath]
+
+    def sources(self):
+        u"""Estado actual de los csv del directorio."""
+        stamp = []
+        with os.scandir(self.dirpath) as entries:
+            for entry in entries:
+                if entry.name.endswith('.csv'):
+                    stat = entry.stat()
+                    stamp.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        return sorted(stamp)
+
+    def get(self, name):
+        u"""Arreglo de los datos normales name (hip, knee, ankle, stp, rom)."""
+        stamp = self.sources()
+        if stamp != self.stamp:
+            self.load(stamp)
+        return self.data[name]
+
+    def load(self, stamp):
+        key = json.dumps(stamp)
+        path = os.path.join(self.dirpath, self.compiled)
+        data = {}
+        if os.path.isfile(path):
+            try:
+                with np.load(path) as npz:
+                    if str(npz['stamp']) == key:
+                        data = {k: npz[k] for k in npz.files if k != 'stamp'}
+            except Exception:
+                # Copia dañada: se vuelven a leer los csv.
+                logging.debug("No se pudo leer %s", path, exc_info=True)
+                data = {}
+        if not data:
+            for filename, __, __ in stamp:
+                with open(os.path.join(self.dirpath, filename)) as fh:
+                    data[filename[:-4]] = np.loadtxt(fh, delimiter=',')
+            self.save(path, key, data)
+        for array in data.values():
+            array.setflags(write=False)
+        self.data = data
+        self.stamp = stamp
+
+    def save(self, path, key, data):
+        u"""Guarda la copia binaria.
+
+        Se escribe en un archivo temporal que luego reemplaza al anterior,
+        para que otros procesos nunca lean una copia incompleta.
+        """
+        tmppath = None
+        try:
+            fd, tmppath = tempfile.mkstemp(suffix='.tmp', dir=self.dirpath)
+            with os.fdopen(fd, 'wb') as fh:
+                np.savez(fh, stamp=key, **data)
+            os.replace(tmppath, path)
+        except OSError:
+            logging.debug("No se pudo guardar %s", path)
+            if tmppath is not None and os.path.exists(tmppath):
+                os.remove(tmppath)
+
+
+class Template(object):
+    u"""Figura ya construida, que se reutiliza cambiando sólo sus curvas.
+
+    Los ejes, títulos, etiquetas y bandas de normalidad se dibujan una vez;
+    las curvas y líneas verticales se actualizan con set_data y las que
+    sobran se ocultan. Como las líneas se reutilizan, el orden en que se
+    dibujan se fija con zorder (ver AnglePlot.plot). references son las
+    líneas fijas que devuelve la construcción de la figura.
+    """
+
+    def __init__(self, figure, axes, references=()):
+        self.figure = figure
+        self.axes = axes
+        self.references = list(references)
+        self.lines = [[] for __ in axes]
+        self.vlines = [[] for __ in axes]
+
+    def set_lines(self, pos, curves, colors, labels=(), zorders=None):
+        ax = self.axes[pos]
+        pool = self.lines[pos]
+        for n, curve in enumerate(curves):
+            if n == len(pool):
+                pool.extend(ax.plot([], []))
+            pool[n].set_data(np.arange(len(curve)), curve)
+            pool[n].set_color(colors[n])
+            pool[n].set_label(labels[n] if n < len(labels) else '_nolegend_')
+            pool[n].set_zorder(2 if zorders is None else zorders[n])
+            pool[n].set_visible(True)
+        self.hide(pool[len(curves):])
+
+    def set_vlines(self, pos, positions, colors, zorders=None):
+        ax = self.axes[pos]
+        pool = self.vlines[pos]
+        for n, x in enumerate(positions):
+            if n == len(pool):
+                pool.append(ax.axvline(0, ls='--', lw=0.7, alpha=0.5))
+            pool[n].set_xdata([x, x])
+            pool[n].set_color(colors[n])
+            pool[n].set_zorder(2 if zorders is None else zorders[n])
+            pool[n].set_visible(True)
+        self.hide(pool[len(positions):])
+
+    @staticmethod
+    def hide(lines):
+        for line in lines:
+            line.set_visible(False)
+            line.set_label('_nolegend_')
+
+    def autoscale(self):
+        u"""Recalcula los límites con las curvas visibles y las bandas."""
+        for ax in self.axes:
+            ax.relim(visible_only=True)
+            # relim no considera las colecciones (fill_between).
+            for collection in ax.collections:
+                ax.update_datalim(
+                    collection.get_datalim(ax.transData).get_points())
+        for ax in self.axes:
+            ax.autoscale_view()
+
+
 class Curves(object):
+    # Figuras ya construidas del proceso, por tipo de gráfico, disposición y
+    # configuración [plots] (ver Curves.use_template).
+    templates = {}
 
     def __init__(self, config):
         self.subplotparams = {'top': .85, 'wspace': .5}
         self.config = config
         self.figure = None
+        self.template = None
         self._color = None
         self.title = ""
         self.ndata = 0
@@ -68,6 +223,18 @@ class Curves(object):
         self.figure.suptitle(title, fontsize=fontsize)
         return self.figure
 
+    def use_template(self, key, build):
+        u"""Figura del proceso para key; build la construye la primera vez."""
+        key = (type(self).__name__, key, tuple(self.config.items('plots')))
+        if key not in self.templates:
+            self.axes = []
+            references = build() or ()
+            self.templates[key] = Template(self.figure, self.axes, references)
+        self.template = self.templates[key]
+        self.figure = self.template.figure
+        self.axes = self.template.axes
+        return self.template
+
     def add_axes(self, name, pos):
         sharey = None if not self.axes else self.axes[0]
         self.axes.append(self.figure.add_subplot(*pos, sharey=sharey))
@@ -75,9 +242,7 @@ class Curves(object):
         return self.axes[-1]
 
     def add_normal(self, name, pos):
-        dirpath = self.config.get("paths", "normal")
-        with open(os.path.join(dirpath, "%s.csv" % name)) as fh:
-            mean, dev = np.loadtxt(fh, delimiter=',')
+        mean, dev = NormalData.from_config(self.config).get(name)
         std = dev * self.config.getint('plots', 'standardeviation')
         x = np.arange(mean.size)
         self.axes[pos].fill_between(x, mean - std, mean + std, color='k',
@@ -89,8 +254,11 @@ class Curves(object):
             logging.error("%s No se encontró figura" % destpath)
             return
         self.figure.subplots_adjust(**self.subplotparams)
-        self.figure.savefig(os.path.join(destpath, self.title))
-        plt.close(self.figure)
+        with profiler.stage('savefig'):
+            self.figure.savefig(os.path.join(destpath, self.title))
+        # Las figuras de las plantillas quedan abiertas para reutilizarlas.
+        if self.template is None:
+            plt.close(self.figure)
 
 
 class WalkPlot(Curves):
@@ -100,12 +268,21 @@ class WalkPlot(Curves):
 
     def plot(self, cycler, destpath):
         for (wid, vel, mov) in cycler.movement:
-            fig = self.new_figure("W%s" % wid)
-            ax = self.add_axes("", (1, 1, 1))
-            ax.plot(vel.T)
-            ax.plot(mov*5)
-            self.title = "Ciclado de caminata W%s" % wid
-            self.save(destpath)
+            self.plot_walk(wid, vel, mov, destpath)
+
+    def build_walk(self):
+        self.new_figure("")
+        self.add_axes("", (1, 1, 1))
+
+    def plot_walk(self, wid, vel, mov, destpath):
+        template = self.use_template((), self.build_walk)
+        self.figure.suptitle("W%s" % wid,
+                             fontsize=self.config.getint('plots', 'titlesize'))
+        curves = list(vel) + [mov*5]
+        template.set_lines(0, curves, ['C%d' % n for n in range(len(curves))])
+        template.autoscale()
+        self.title = "Ciclado de caminata W%s" % wid
+        self.save(destpath)
 
 
 class AnglePlot(Curves):
@@ -148,32 +325,67 @@ class AnglePlot(Curves):
             self.legends = {'leftside': ['leftside', ],
                             'rightside': ['rightside', ]}
 
+    def build_angles(self, names, summary):
+        u"""Construye la figura y devuelve las líneas del cero de cada eje.
+
+        Hay una línea del cero por lado, que se dibuja después de las curvas
+        de ese lado.
+        """
+        self.new_figure(self.title)
+        zerolines = []
+        for j, name in enumerate(names):
+            ax = self.add_axes(name, (1, len(names), j+1))
+            if summary:
+                self.add_normal(name, j)
+            zerolines.append([ax.axhline(0, c='k', ls='--',
+                                         zorder=2.05 + .2 * k)
+                              for k in range(2)])
+            ax.set_xlabel('Ciclo [%]')
+            ax.set_ylabel('Grados [°]')
+        return zerolines
+
     def plot(self, summary=False, putlegends=False):
         if self.joints == []:
             return
-        figure = self.new_figure(self.title)
+        names = tuple(joint['name'] for joint in self.joints)
+        key = (self.title, names, summary, putlegends)
+        if summary:
+            # Las bandas cambian si cambian los datos de normalidad.
+            key += (tuple(NormalData.from_config(self.config).sources()),)
+        template = self.use_template(
+            key, lambda: self.build_angles(names, summary))
         for j, joint in enumerate(self.joints):
-            ax = self.add_axes(joint['name'], (1, self.count, j+1))
             if summary:
                 self.summary(j)
-                self.add_normal(joint['name'], j)
                 self.color = ('r', 'b')
-            ax.set_prop_cycle(plt.cycler('color', self.color))
-            vlinecolor = 0
-            for side in self.joints[j]['sides']:
-                lines = ax.plot(self.joints[j][side]['curves'].transpose())
-                [l.set_label(s) for l, s in zip(lines, self.legends[side])]
-                ax.axhline(0, c='k', ls='--')
-                ax.set_xlabel('Ciclo [%]')
-                ax.set_ylabel('Grados [°]')
-                for line in self.joints[j][side]['vlines']:
-                    color = self.color[vlinecolor]
-                    ax.axvline(line, c=color, ls='--', lw=0.7, alpha=0.5)
-                    vlinecolor += 1
+            curves, labels, vlines = [], [], []
+            # Cada lado se dibuja sobre el anterior: sus curvas, luego su
+            # línea del cero y luego sus líneas verticales.
+            zorders, vzorders = [], []
+            for k, side in enumerate(joint['sides']):
+                sidecurves = np.atleast_2d(joint[side]['curves'])
+                curves.extend(sidecurves)
+                labels.extend(self.legends[side][:len(sidecurves)])
+                labels.extend(['_nolegend_'] * (len(sidecurves) -
+                                                len(self.legends[side])))
+                vlines.extend(joint[side]['vlines'])
+                zorders += [2 + .2 * k] * len(sidecurves)
+                vzorders += [2.1 + .2 * k] * len(joint[side]['vlines'])
+            for k, zeroline in enumerate(template.references[j]):
+                zeroline.set_visible(k < len(joint['sides']))
+            # Los colores se asignan en orden, como un ciclo de propiedades.
+            color = self.color
+            template.set_lines(j, curves,
+                               [color[n % len(color)]
+                                for n in range(len(curves))], labels, zorders)
+            template.set_vlines(j, vlines, [color[n]
+                                            for n in range(len(vlines))],
+                                vzorders)
+        template.autoscale()
         if putlegends:
-            plt.legend(bbox_to_anchor=(-3.2, -.6, 4.4, .3), loc="center",
-                       ncol=10, mode="expand", borderaxespad=0.,
-                       fontsize="x-small")
+            self.axes[-1].legend(bbox_to_anchor=(-3.2, -.6, 4.4, .3),
+                                 loc="center", ncol=10, mode="expand",
+                                 borderaxespad=0., fontsize="x-small")
             self.subplotparams['bottom'] = .35
 
 
@@ -191,9 +403,7 @@ class Table(object):
         self.subtables = []
 
     def add_normal(self, config_name, header="", formater=""):
-        dirpath = self.config.get("paths", "normal")
-        with open(os.path.join(dirpath, "%s.csv" % config_name)) as fh:
-            norm = np.loadtxt(fh, delimiter=',').round(1)
+        norm = NormalData.from_config(self.config).get(config_name).round(1)
         cols = ['${}{}{}$'.format(u, formater, v) for u, v in norm.transpose()]
         self.add_subtable(header, np.array(cols).reshape(len(cols), 1), ['k', ])
         self.normalflag = True
@@ -225,25 +435,28 @@ class Table(object):
         return ylines, ylines[:-1] + np.diff(ylines)*.5
 
 
+    @property
+    def mastertable(self):
+        u"""Celdas de la tabla: índice, encabezados y valores."""
+        return np.hstack((self.index, np.hstack((self.subtables))))
+
     def build_grid(self, fig):
+        u"""Dibuja todas las líneas de la grilla como un único artista."""
         xlines, __ = self.xpoints
         ylines, __ = self.ypoints
-        xbounds = xlines[np.newaxis, (0, -1)]
-        ybounds = ylines[np.newaxis, (0, -1)]
-        lines = []
-        for level in ylines:
-            l = Line2D(xbounds, (level, level), color='k',
-                       transform=fig.transFigure)
-            lines.append(l)
-        for level in xlines:
-            l = Line2D((level, level), ybounds, color='k',
-                       transform=fig.transFigure)
-            lines.append(l)
-        fig.lines.extend(lines)
+        horizontal = np.empty((ylines.size, 2, 2))
+        horizontal[:, :, 0] = xlines[[0, -1]]
+        horizontal[:, :, 1] = ylines[:, np.newaxis]
+        vertical = np.empty((xlines.size, 2, 2))
+        vertical[:, :, 0] = xlines[:, np.newaxis]
+        vertical[:, :, 1] = ylines[[0, -1]]
+        fig.add_artist(LineCollection(np.vstack((horizontal, vertical)),
+                                      colors='k', capstyle='projecting',
+                                      transform=fig.transFigure))
 
     def build_text(self, fig):
-        mastertable = np.hstack((self.index, np.hstack((self.subtables))))
-        textsize = np.zeros(mastertable.shape, dtype=np.int)
+        mastertable = self.mastertable
+        textsize = np.zeros(mastertable.shape, dtype=int)
         textsize[:, 0] = self.config.getint('plots', 'subtitlesize')
         textsize[0, :] = self.config.getint('plots', 'subtitlesize')
         textsize[1:, 1:] = self.config.getint('plots', 'textsize')
@@ -279,15 +492,66 @@ class Table(object):
         self.build_text(self.figure)
 
     def save(self, destpath):
-        self.figure.savefig(os.path.join(destpath, self.title))
+        with profiler.stage('savefig'):
+            self.figure.savefig(os.path.join(destpath, self.title))
         plt.close(self.figure)
 
+    def export(self, destpath, fmt='csv'):
+        u"""Guarda las celdas de la tabla como texto (csv o html)."""
+        cells = np.vectorize(plain_text, otypes=['U64'])(self.mastertable)
+        return write_rows(os.path.join(destpath, self.title), cells[0],
+                          cells[1:], fmt)
+
+
+def plain_text(cell):
+    u"""Texto de una celda sin la notación matemática de matplotlib."""
+    return cell.replace('$', '').replace('\\pm', '±')
+
+
+def write_rows(path, header, rows, fmt='csv'):
+    u"""Escribe una tabla en path.csv o path.html, sin dibujarla."""
+    path = '%s.%s' % (path, fmt)
+    with open(path, 'w', newline='') as fh:
+        if fmt == 'csv':
+            writer = csv.writer(fh)
+            writer.writerow(header)
+            writer.writerows(rows)
+        elif fmt == 'html':
+            fh.write('<table>\n<tr>%s</tr>\n' % ''.join(
+                '<th>%s</th>' % html.escape(str(h)) for h in header))
+            for row in rows:
+                fh.write('<tr>%s</tr>\n' % ''.join(
+                    '<td>%s</td>' % html.escape(str(c)) for c in row))
+            fh.write('</table>\n')
+        else:
+            raise ValueError("Formato desconocido: %s" % fmt)
+    return path
+
+
+def export_cycles(destpath, labels, direction, stp, fmt='csv'):
+    u"""Guarda los parámetros espaciotemporales de cada ciclo.
+
+    stp son las columnas de SpatioTemporal.rows, una fila por ciclo.
+    """
+    header = ('Ciclo', 'Lado') + SpatioTemporal.rows
+    sides = np.where(direction == 0, 'Izquierdo', 'Derecho')
+    rows = [(label, side) + tuple(values.round(3).tolist())
+            for label, side, values in zip(labels, sides, stp)]
+    return write_rows(os.path.join(destpath, 'Ciclos'), header, rows, fmt)
+
+
+def export_formats(config):
+    u"""Formatos de [plots] export (csv, html) para exportar las tablas."""
+    formats = config.get('plots', 'export', fallback='')
+    return [fmt.strip() for fmt in formats.split(',') if fmt.strip()]
+
 
 class SpatioTemporal(Table):
+    rows = ("Duración [s]", "F.Apoyo [%]", "F.Balanceo [%]",
+            "L.Zancada [m]", "Cadencia [p/min]", "Velocidad [m/s]")
 
     def build(self, params):
-        index = ("Duración [s]", "F.Apoyo [%]", "F.Balanceo [%]",
-                 "L.Zancada [m]", "Cadencia [p/min]", "Velocidad [m/s]")
+        index = self.rows
         header = ("Izquierdo", "Derecho")
         paramcolors = ['r', 'b']
 
@@ -307,3 +571,87 @@ class ROM(Table):
         self.add_subtable(header, params, paramcolors)
         self.add_normal('rom', ("Normal [Min < Max]",), "<")
         super().build()
+
+
+def render_walk(config, destpath, wid, vel, mov):
+    u"""Gráfico de velocidad y movimiento del ciclado de una caminata."""
+    WalkPlot(config).plot_walk(wid, vel, mov, destpath)
+
+
+def render_angles(config, destpath, title, joints, direction, labels, vlines,
+                  summary=False, putlegends=False):
+    u"""Gráfico de las curvas articulares; joints son pares (nombre, curvas)."""
+    angles = AnglePlot(title, config=config)
+    for name, curves in joints:
+        angles.add_joint(name, direction, labels, curves, vlines)
+    angles.plot(summary=summary, putlegends=putlegends)
+    angles.save(destpath)
+
+
+def render_table(config, destpath, table, title, params):
+    u"""Tabla de la clase table (SpatioTemporal, ROM) con los parámetros."""
+    table = table(config, title)
+    table.build(params)
+    table.save(destpath)
+    for fmt in export_formats(config):
+        table.export(destpath, fmt)
+
+
+def render_spec(function, args):
+    u"""Dibuja una figura en un proceso de trabajo.
+
+    Devuelve las mediciones de tiempo del proceso (ver profiling), que se
+    configura con la configuración, el primer argumento de la figura.
+    """
+    profiler.configure(args[0])
+    function(*args)
+    return profiler.stages
+
+
+class Renderer(object):
+    u"""Agenda de figuras para dibujar y guardar juntas.
+
+    Cada figura se describe con una función render_* de este módulo y sus
+    argumentos (datos, títulos y rutas), que se pueden enviar a otro proceso.
+    Con [plots] workers > 1 las figuras se dibujan en paralelo en un grupo de
+    procesos, mientras el proceso principal continúa (ver start y wait).
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.workers = config.getint('plots', 'workers', fallback=1)
+        self.specs = []
+        self.executor = None
+        self.futures = []
+
+    def add(self, function, *args):
+        self.specs.append((function, args))
+
+    def start(self):
+        u"""Comienza a dibujar las figuras en otros procesos, si corresponde."""
+        workers = min(self.workers, len(self.specs))
+        if workers < 2:
+            return
+        self.executor = ProcessPoolExecutor(workers)
+        self.futures = [self.executor.submit(render_spec, function, args)
+                        for function, args in self.specs]
+        self.specs = []
+
+    def wait(self):
+        u"""Termina de dibujar las figuras agendadas."""
+        for function, args in self.specs:
+            function(*args)
+        self.specs = []
+        if self.executor is None:
+            return
+        try:
+            for future in self.futures:
+                profiler.merge(future.result())
+        finally:
+            self.executor.shutdown()
+            self.executor = None
+            self.futures = []
+
+    def run(self):
+        self.start()
+        self.wait()
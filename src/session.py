@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+u"""Sesiones de trabajo y generación de sus resultados.
+
+Lo usan tanto la aplicación como el análisis por lotes (ver batch).
+"""
+
+# Copyright (C) 2019  Mariano Ramis
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from .video import Pics
+from .settings import new_session
+from .profiling import profiler
+from .representation import (Renderer, SpatioTemporal, ROM, render_walk,
+                             render_angles, render_table, export_cycles,
+                             export_formats)
+
+
+def write_outputs(config, source, walks, kinematics):
+    u"""Genera las imágenes y tablas de la sesión actual.
+
+    Las rutas de destino se toman de la sección [current] de config; la
+    cinemática ya debe haber procesado las caminatas (ver
+    Kinematics.cycle_walks).
+    """
+    destpath = config.get('current', 'session')
+    renderer = Renderer(config)
+
+    # Resultados del ciclado.
+    walksdir = config.get('current', 'walks')
+    for wid, vel, mov in kinematics.cycler.movement:
+        renderer.add(render_walk, config, walksdir, wid, vel, mov)
+
+    labels, direction, stp, hip, knee, ankle = kinematics.to_plot()
+    # Por ahora no se están aceptando en la tabla los datos de tiempos de
+    # fase
+    stp = stp[:, [1, 4, 5, 6, 7, 8]]
+    for fmt in export_formats(config):
+        export_cycles(destpath, labels, direction, stp, fmt)
+
+    # Promedios y rango de movimiento de los ciclos activos.
+    meanstp, __, rom = kinematics.summary()
+
+    # parámetros espacio temporales
+    renderer.add(render_table, config, destpath, SpatioTemporal,
+                 "Parámetros espacio-temporales",
+                 meanstp[:, [1, 4, 5, 6, 7, 8]].round(1).transpose())
+    # cinemática ángulos
+    renderer.add(render_angles, config, destpath, 'Cinematica',
+                 (('cadera', hip), ('rodilla', knee), ('tobillo', ankle)),
+                 direction, labels, stp[:, 1], False, True)
+    # Cada articulación por separado, con el promedio de cada lado.
+    for title, name, curves in (('Cadera', 'hip', hip),
+                                ('Rodilla', 'knee', knee),
+                                ('Tobillo', 'ankle', ankle)):
+        renderer.add(render_angles, config, destpath, title,
+                     ((name, curves),), direction, labels, stp[:, 1], True)
+    # ROM
+    renderer.add(render_table, config, destpath, ROM, "Rango de movimiento",
+                 rom.round(1))
+
+    # Las figuras se dibujan en otros procesos ([plots] workers) mientras se
+    # generan las pics de los ciclos.
+    renderer.start()
+    try:
+        pics = Pics(config)
+        pics.open(source)
+        pics.make_pics(kinematics.cycler.activesv, walks)
+    finally:
+        renderer.wait()
+    profiler.save(destpath)
+
+
+def set_session(config, source, name=None):
+    u"""Crea la sesión del video y la registra en la sección [current].
+
+    La sesión se llama como el archivo del video, salvo que se indique name.
+    """
+    session, walks, pics, cache = new_session(name or source)
+    config.set('current', 'session', session)
+    config.set('current', 'walks', walks)
+    config.set('current', 'pics', pics)
+    config.set('current', 'cache', cache)
+    return session
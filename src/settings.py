@@ -47,10 +47,17 @@ sourcedir = {HOME}
 session =
 walks =
 pics =
+cache =
 
 [explorer]
 dilate = False
 threshold = 240
+backend = contours
+tracking = False
+scale = 1
+channel = gray
+workers = 1
+chunksize = 600
 
 [walk]
 roiwidth = 125
@@ -58,6 +65,8 @@ roiheight = 35
 
 [video]
 delay = .1
+buffersize = 64
+picworkers = 2
 framewidth = 640
 frameheight = 480
 
@@ -68,7 +77,9 @@ fpscorrection = 1
 [kinematics]
 stpsize = 6
 nfixed = 100
+resampling = linear
 maxcycles = 50
+dtype = float64
 anglessize = 100
 leftlength = 0.28
 rightlength = 0.28
@@ -77,6 +88,9 @@ cyclemarker2 = M6
 leftthreshold = 3.2
 rightthreshold = 3.2
 filter_by_duration = False
+smoothing = sweep
+smoothloops = 8
+smoothwindow = 9
 
 [schema]
 n = 7
@@ -88,6 +102,10 @@ markersxroi = 0,1/2,3/4,5,6
 order_segments = tight,leg,foot
 order_joints = hip,knee,ankle
 
+[profiling]
+enabled = False
+cprofile =
+
 [plots]
 dpi = 80
 textsize = 16
@@ -100,6 +118,8 @@ subtitlesize = 18
 standardeviation = 2
 cell_index_width = 0.3
 cell_normal_width = 0.25
+workers = 1
+export =
 """
 
 # Se crea/carga el archivo de configuración.
@@ -119,8 +139,8 @@ def new_session(name):
     sessiondir = os.path.join(SESSION_DIR, os.path.basename(name))
     walkdir = os.path.join(sessiondir, 'walks')
     picsdir = os.path.join(sessiondir, 'cycles')
-    if not os.path.isdir(sessiondir):
-        os.mkdir(sessiondir)
-        os.mkdir(walkdir)
-        os.mkdir(picsdir)
-    return sessiondir, walkdir, picsdir
+    cachedir = os.path.join(sessiondir, 'cache')
+    for directory in (sessiondir, walkdir, picsdir, cachedir):
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+    return sessiondir, walkdir, picsdir, cachedir
@@ -19,19 +19,103 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import hashlib
+import logging
 from time import sleep
+from queue import Queue
+from itertools import repeat, permutations
+from threading import Thread, Semaphore
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
 import cv2
 
+try:
+    from .profiling import profiler
+except ImportError:  # Importado como módulo suelto (ver test/).
+    from profiling import profiler
+
+
+# Canales del cuadro BGR que se pueden usar para detectar los marcadores.
+CHANNELS = {'blue': 0, 'green': 1, 'red': 2}
+
+# Opciones de [explorer] que modifican el resultado de la detección.
+DETECTION_OPTIONS = ('threshold', 'dilate', 'backend', 'tracking', 'scale',
+                     'channel')
+
+# Opciones que además modifican la detección en el modo de seguimiento.
+TRACKING_OPTIONS = (('schema', 'n'), ('walk', 'roiwidth'), ('walk', 'roiheight'))
+
+
+class FrameReader(Thread):
+    u"""Decodifica los cuadros del video en un hilo aparte.
+
+    Los cuadros se escriben sobre un anillo de buffers reservados de antemano;
+    el hilo se detiene cuando todos los buffers están ocupados, y un buffer se
+    libera cuando el consumidor pide el cuadro siguiente.
+    """
+
+    def __init__(self, cap, count, ring):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.count = count
+        self.ring = ring
+        self.nread = 0
+        self.stopped = False
+        self.free = Semaphore(len(ring))
+        self.ready = Queue()
+
+    def run(self):
+        slot = 0
+        while self.count is None or self.nread < self.count:
+            self.free.acquire()
+            if self.stopped:
+                break
+            with profiler.stage('decode') as stage:
+                ret, frame = self.cap.read(self.ring[slot])
+                stage.frames = int(ret)
+            if not ret:
+                break
+            self.nread += 1
+            # read() escribe en el buffer del anillo si la forma coincide.
+            if not np.shares_memory(frame, self.ring[slot]):
+                if frame.shape != self.ring[slot].shape:
+                    self.ready.put(frame)  # Cuadro fuera del anillo.
+                    continue
+                self.ring[slot] = frame
+            self.ready.put(self.ring[slot])
+            slot = (slot + 1) % len(self.ring)
+        self.ready.put(None)
+
+    def __iter__(self):
+        self.start()
+        try:
+            while True:
+                frame = self.ready.get()
+                if frame is None:
+                    break
+                yield frame
+                self.free.release()
+        finally:
+            self.stopped = True
+            self.free.release()
+            self.join()
+
 
 class Video(object):
 
     def __init__(self, config):
         self.cap = None
+        self.tracks = None
         self.config = config
         self._dilate = config.getboolean('explorer', 'dilate')
         self._threshold = config.getfloat('explorer', 'threshold')
+        self._backend = config.get('explorer', 'backend', fallback='contours')
+        self._kernel = np.ones((3, 3), np.uint8)
+        self._tracking = config.getboolean('explorer', 'tracking',
+                                           fallback=False)
+        self._scale = config.getfloat('explorer', 'scale', fallback=1.)
+        self._channel = config.get('explorer', 'channel', fallback='gray')
 
     def __del__(self):
         if self.cap is not None and self.cap.isOpened():
@@ -44,33 +128,204 @@ class Video(object):
         self.cap = cv2.VideoCapture(path)
         self.fps = int(self.cap.get(cv2.CAP_PROP_FPS))
         self.size = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.shape = (int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                      int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+        self._pos = 0
         return self.cap, self.fps, self.size
 
-    def centers(self, contours):
-        u"""Obtiene los centros de los contornos como un arreglo de numpy."""
-        def contour_center(contour):
-            u"""Devuelve el centro del contorno."""
-            x, y, w, h = cv2.boundingRect(contour)
-            return x + w/2, y + h/2
-        ccenters = [contour_center(c) for c in contours]
-        return np.array(ccenters, dtype=np.int16)[::-1]
+    def seek(self, pos):
+        u"""Ubica la captura en el cuadro indicado."""
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, pos)
+        self._pos = pos
+
+    def nbuffers(self):
+        u"""Cantidad de cuadros que entran en la memoria de lectura."""
+        megabytes = self.config.getfloat('video', 'buffersize', fallback=64)
+        if megabytes <= 0:
+            return 0
+        return max(2, int(megabytes * 2**20) // int(np.prod(self.shape)))
+
+    def frames(self, start=0, stop=None):
+        u"""Recorre los cuadros [start, stop) del video.
+
+        Devuelve por cada cuadro la tupla (posición, cuadro). Los cuadros se
+        decodifican en un hilo aparte sobre un anillo de [video] buffersize
+        megabytes, por lo que cada cuadro es válido hasta pedir el siguiente.
+        La posición se obtiene contando los cuadros leídos. Con buffersize = 0
+        la lectura se hace en el mismo hilo.
+        """
+        # La captura puede haber quedado en cualquier posición (o más adelante,
+        # por la lectura anticipada del hilo), así que se ubica en start.
+        if start != self._pos:
+            self.seek(start)
+        count = None if stop is None else stop - start
+        nbuffers = self.nbuffers()
+        if not nbuffers:
+            while count is None or count > 0:
+                ret, pos, frame = self.read_frame()
+                if not ret:
+                    break
+                yield pos, frame
+                if count is not None:
+                    count -= 1
+            return
+        ring = np.empty((nbuffers,) + self.shape, dtype=np.uint8)
+        reader = FrameReader(self.cap, count, ring)
+        decoded = iter(reader)
+        try:
+            for pos, frame in enumerate(decoded, start + 1):
+                yield pos, frame
+        finally:
+            decoded.close()
+            self._pos = start + reader.nread
 
-    def contours(self, frame):
-        u"""Encuentra dentro del cuadro los contornos de los marcadores."""
-        # 6 = cv2.COLOR_BGR2GRAY
-        gray = cv2.cvtColor(frame, 6)
+    def centers(self, contours):
+        u"""Obtiene los centros de los contornos como un arreglo de numpy.
+
+        El centro es el del rectángulo que encierra cada contorno, calculado a
+        partir de los extremos de todos los puntos en una sola operación, y se
+        devuelve en coordenadas del cuadro original.
+        """
+        if not len(contours):
+            return np.array([], dtype=np.int16)
+        points = np.concatenate(contours).reshape(-1, 2)
+        starts = np.cumsum([0] + [len(c) for c in contours[:-1]])
+        lower = np.minimum.reduceat(points, starts)
+        upper = np.maximum.reduceat(points, starts)
+        return self.box_centers(lower, upper)[::-1]
+
+    def box_centers(self, lower, upper):
+        u"""Centros de los rectángulos [lower, upper] en el cuadro original."""
+        # x + w/2, con w = upper - lower + 1, deshaciendo la escala.
+        return ((lower + upper + 1) / (2. * self._scale)).astype(np.int16)
+
+    def binary(self, frame):
+        u"""Umbraliza el cuadro para separar los marcadores del fondo.
+
+        Con [explorer] channel se puede usar un solo canal del cuadro en lugar
+        de la luminancia, y con [explorer] scale se reduce la resolución antes
+        de umbralizar.
+        """
+        if self._channel == 'gray':
+            if self._scale != 1:
+                frame = cv2.resize(frame, None, fx=self._scale, fy=self._scale,
+                                   interpolation=cv2.INTER_AREA)
+            # 6 = cv2.COLOR_BGR2GRAY
+            gray = cv2.cvtColor(frame, 6)
+        else:
+            gray = cv2.extractChannel(frame, CHANNELS[self._channel])
+            if self._scale != 1:
+                gray = cv2.resize(gray, None, fx=self._scale, fy=self._scale,
+                                  interpolation=cv2.INTER_AREA)
         # 0 = cv2.THRESH_BINARY
         binary = cv2.threshold(gray, self._threshold, 255., 0)[1]
         if self._dilate:
-            kernel = np.ones((3, 3), np.uint8)
-            binary = cv2.dilate(binary, kernel, iterations=3)
+            binary = cv2.dilate(binary, self._kernel, iterations=3)
+        return binary
+
+    def contours(self, frame):
+        u"""Encuentra dentro del cuadro los contornos de los marcadores."""
         # 0 = cv2.RETR_EXTERNAL
         # 2 = cv2.CHAIN_APPROX_SIMPLE
-        contours, __ = cv2.findContours(binary, 0, 2)
+        contours, __ = cv2.findContours(self.binary(frame), 0, 2)
         if contours is None:
             contours = [[], ]  # Parche por el cambio de version de opencv.
         return len(contours), contours
 
+    def components(self, frame):
+        u"""Encuentra los centros de los marcadores como componentes conexas.
+
+        Los centros son los de los rectángulos que encierran cada componente,
+        en el mismo orden que devuelve centers, pero calculados en un único
+        arreglo sin recorrer los contornos. Como en contours, sólo se cuentan
+        las componentes exteriores: las que están dentro de un agujero de otra
+        se descartan (ver fill_holes).
+        """
+        binary = self.binary(frame)
+        n, lower, upper = self.label(binary)
+        if n > 1:
+            # Una componente anidada queda dentro del rectángulo de otra; sólo
+            # en ese caso hace falta rellenar los agujeros y volver a etiquetar.
+            inside = np.logical_and(
+                np.all(lower[:, np.newaxis] >= lower, axis=2),
+                np.all(upper[:, np.newaxis] <= upper, axis=2))
+            np.fill_diagonal(inside, False)
+            if inside.any():
+                n, lower, upper = self.label(self.fill_holes(binary))
+        return n, self.box_centers(lower, upper)
+
+    def label(self, binary):
+        u"""Número de componentes y sus rectángulos [lower, upper]."""
+        # El etiquetado de Wu recorre la imagen por filas, y numera las
+        # componentes en el mismo orden en que se encuentran los contornos.
+        n, __, stats, __ = cv2.connectedComponentsWithStatsWithAlgorithm(
+            binary, 8, cv2.CV_32S, cv2.CCL_WU)
+        # La etiqueta 0 es el fondo.
+        lower = stats[1:, :2]
+        return n - 1, lower, lower + stats[1:, 2:4] - 1
+
+    def fill_holes(self, binary):
+        u"""Rellena el fondo que no está conectado con el borde del cuadro."""
+        # Con un borde de fondo, el relleno desde una esquina (conectividad 4,
+        # la del fondo de componentes de conectividad 8) alcanza todo el fondo
+        # exterior.
+        outside = cv2.copyMakeBorder(binary, 1, 1, 1, 1,
+                                     cv2.BORDER_CONSTANT, value=0)
+        cv2.floodFill(outside, None, (0, 0), 255)
+        return cv2.bitwise_or(binary, cv2.bitwise_not(outside[1:-1, 1:-1]))
+
+    def detect(self, frame, roi=None):
+        u"""Devuelve el número de marcadores y sus centros en el cuadro.
+
+        Si se indica la región (x0, y0, x1, y1) la búsqueda se limita a ella, y
+        los centros se devuelven en coordenadas del cuadro completo.
+        """
+        with profiler.stage('detect', frames=1):
+            if roi is not None:
+                x0, y0, x1, y1 = roi
+                frame = frame[y0: y1, x0: x1]
+            if self._backend == 'components':
+                n, centers = self.components(frame)
+            else:
+                n, conts = self.contours(frame)
+                centers = self.centers(conts)
+            if roi is not None and n:
+                centers = centers + np.array((x0, y0), dtype=np.int16)
+        return n, centers
+
+    def region(self, centers):
+        u"""Región de búsqueda alrededor de los centros del cuadro anterior."""
+        xextra = self.config.getint('walk', 'roiwidth')
+        yextra = self.config.getint('walk', 'roiheight')
+        (x0, y0), (x1, y1) = centers.min(axis=0), centers.max(axis=0)
+        return (max(int(x0) - xextra, 0), max(int(y0) - yextra, 0),
+                int(x1) + xextra + 1, int(y1) + yextra + 1)
+
+    def scan(self, start=0, stop=None):
+        u"""Recorre los cuadros [start, stop) y detecta los marcadores.
+
+        Devuelve por cada cuadro la tupla (posición, n, centros). Si stop es
+        None la lectura continúa hasta el final del video.
+
+        En el modo de seguimiento ([explorer] tracking), una vez encontrado el
+        esquema completo la búsqueda se limita a la región que rodea a los
+        marcadores del cuadro anterior, y sólo se vuelve al cuadro completo
+        cuando en la región se encuentran menos marcadores que en el esquema.
+        El seguimiento termina, como la caminata, en el cuadro sin marcadores.
+        """
+        nmarkers = self.config.getint('schema', 'n')
+        roi = None
+        for pos, frame in self.frames(start, stop):
+            n, centers = self.detect(frame, roi)
+            if roi is not None and n < nmarkers:
+                n, centers = self.detect(frame)
+            if self._tracking:
+                if n == nmarkers:
+                    roi = self.region(centers)
+                elif n == 0:
+                    roi = None
+            yield pos, n, centers
+
     def get_fps(self):
         u"""Devuelve el número de cuadros por segundos."""
         correction = self.config.getfloat('camera', 'fpscorrection')
@@ -78,9 +333,12 @@ class Video(object):
 
     def read_frame(self):
         u"""Lectura de cuadro de video."""
-        ret, frame = self.cap.read()
-        pos = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
-        return ret, pos, frame
+        with profiler.stage('decode') as stage:
+            ret, frame = self.cap.read()
+            stage.frames = int(ret)
+        if ret:
+            self._pos += 1
+        return ret, self._pos, frame
 
     def new_window(self, name, extra=''):
         width = self.config.getint('video', 'framewidth')
@@ -116,11 +374,14 @@ class Video(object):
         for (p0, p1), c in zip(regions, condition):
             cv2.rectangle(frame, tuple(p0), tuple(p1), color[c], 3)
 
-    def draw_function(self, drawtype, frame, walk, pos):
+    def draw_function(self, drawtype, frame, walk, pos, framepos):
         if drawtype is "preview":
-            n, conts = self.contours(frame)
+            if self.tracks is not None and self.tracks.loaded:
+                n, centers = self.tracks.get(framepos)
+            else:
+                n, centers = self.detect(frame)
             self.draw_n(frame, n)
-            self.draw_markers(frame, self.centers(conts))
+            self.draw_markers(frame, centers)
         elif drawtype is "walk":
             self.draw_markers(frame, walk.markers[pos], True)
             self.draw_regions(frame, walk.regions[pos], walk.arrincompleted[pos])
@@ -131,11 +392,9 @@ class Video(object):
         # se establece el rango de cuadros
         stpos = 0 if walk is None else walk.info[1] - 1
         lspos = self.size if walk is None else walk.info[2]
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, stpos)
-        for pos in range(lspos - stpos):
-            ret, __, frame = self.read_frame()
+        for pos, (framepos, frame) in enumerate(self.frames(stpos, lspos)):
             # obtienen y dibujan los marcadores
-            self.draw_function(drawtype, frame, walk, pos)
+            self.draw_function(drawtype, frame, walk, pos, framepos)
             cv2.imshow(win, frame)
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
@@ -143,12 +402,116 @@ class Video(object):
         cv2.destroyAllWindows()
 
 
+class Tracks(object):
+    u"""Registro en disco de los marcadores detectados en un video.
+
+    Los centros de todos los cuadros se guardan en un archivo .npz dentro del
+    directorio cache de la sesión. El nombre del archivo se obtiene del
+    contenido del video y de las opciones de detección, por lo que una nueva
+    exploración de la misma captura no necesita decodificar el video.
+    """
+
+    def __init__(self, config, source):
+        self.config = config
+        self.source = source
+        self.loaded = False
+        self.path = None
+        cachedir = config.get('current', 'cache', fallback='')
+        if cachedir and os.path.isdir(cachedir):
+            self.path = os.path.join(cachedir, '%s.npz' % self.key())
+
+    def key(self):
+        u"""Calcula el identificador del video y las opciones de detección."""
+        digest = hashlib.sha1()
+        with open(self.source, 'rb') as fh:
+            for block in iter(lambda: fh.read(1 << 20), b''):
+                digest.update(block)
+        for option in DETECTION_OPTIONS:
+            value = self.config.get('explorer', option, fallback='')
+            digest.update(('%s=%s;' % (option, value)).encode())
+        if self.config.getboolean('explorer', 'tracking', fallback=False):
+            for section, option in TRACKING_OPTIONS:
+                value = self.config.get(section, option, fallback='')
+                digest.update(('%s=%s;' % (option, value)).encode())
+            # En paralelo, cada rango de cuadros comienza en el cuadro completo.
+            workers = self.config.getint('explorer', 'workers', fallback=1)
+            chunksize = (self.config.get('explorer', 'chunksize', fallback='')
+                         if workers > 1 else '')
+            digest.update(('chunksize=%s;' % chunksize).encode())
+        return digest.hexdigest()
+
+    @property
+    def cached(self):
+        return self.path is not None and os.path.isfile(self.path)
+
+    def load(self):
+        u"""Carga los arreglos del archivo de cache."""
+        with np.load(self.path) as data:
+            self.positions = data['positions']
+            self.offsets = data['offsets']
+            self.values = data['values']
+        self.index = {p: i for i, p in enumerate(self.positions.tolist())}
+        self.loaded = True
+
+    def save(self, positions, counts, values):
+        u"""Guarda los arreglos en el archivo de cache."""
+        self.positions = np.array(positions, dtype=np.int32)
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.values = (np.vstack(values) if values
+                       else np.zeros((0, 2))).astype(np.int16)
+        self.index = {p: i for i, p in enumerate(self.positions.tolist())}
+        self.loaded = True
+        if self.path is not None:
+            with open(self.path, 'wb') as fh:
+                np.savez(fh, positions=self.positions, offsets=self.offsets,
+                         values=self.values)
+
+    def get(self, pos):
+        u"""Devuelve el número de marcadores y los centros de un cuadro."""
+        i = self.index.get(pos)
+        if i is None:
+            return 0, np.zeros((0, 2), dtype=np.int16)
+        centers = self.values[self.offsets[i]: self.offsets[i+1]]
+        return len(centers), centers
+
+    def replay(self):
+        u"""Devuelve las detecciones almacenadas, cuadro a cuadro."""
+        if not self.loaded:
+            self.load()
+        for i, pos in enumerate(self.positions.tolist()):
+            centers = self.values[self.offsets[i]: self.offsets[i+1]]
+            yield pos, len(centers), centers
+
+    def record(self, detections):
+        u"""Almacena las detecciones a medida que se producen."""
+        positions, counts, values = [], [], []
+        for pos, n, centers in detections:
+            positions.append(pos)
+            counts.append(n)
+            values.append(centers.reshape(-1, 2))
+            yield pos, n, centers
+        self.save(positions, counts, values)
+
+
+def detect_chunk(config, source, start, stop):
+    u"""Detecta los marcadores de un rango de cuadros en un proceso aparte.
+
+    Devuelve las detecciones y las mediciones de tiempo del proceso.
+    """
+    profiler.configure(config)
+    video = Video(config)
+    video.open(source)
+    return list(video.scan(start, stop)), profiler.stages
+
+
 class Explorer(object):
 
     def __init__(self, config):
         self.config = config
         self.walks = []
         self.source = None
+        self.tracks = None
 
     def open_file(self, filename):
         self.walks.clear()
@@ -163,17 +526,67 @@ class Explorer(object):
         print('New walk', str(walk))
         return walk
 
-    def find_walks(self, pqueue=None):
-        u"""Encuentra las caminatas dentro de un video."""
+    def detections(self):
+        u"""Devuelve los marcadores detectados cuadro a cuadro en el video.
+
+        Si el video ya fue explorado con las mismas opciones, las detecciones
+        se leen del cache de la sesión sin decodificar ningún cuadro.
+        """
+        self.tracks = Tracks(self.config, self.source)
+        self.video.tracks = self.tracks
+        if self.tracks.cached:
+            return self.tracks.replay()
+        workers = self.config.getint('explorer', 'workers', fallback=1)
+        if workers > 1:
+            return self.tracks.record(self.parallel_detections(workers))
+        return self.tracks.record(self.video.scan(0))
+
+    def parallel_detections(self, workers):
+        u"""Detecta los marcadores por rangos de cuadros en varios procesos.
+
+        Los resultados de cada rango se devuelven en orden, de manera que las
+        caminatas que cruzan el límite entre rangos se unen sin cambios. En el
+        modo de seguimiento, cada rango comienza buscando en el cuadro completo.
+        """
+        chunksize = self.config.getint('explorer', 'chunksize', fallback=600)
+        starts = list(range(0, max(self.nframes, 1), chunksize))
+        # El último rango se lee hasta el final del video, por si el número de
+        # cuadros informado por la captura no es exacto.
+        stops = starts[1:] + [None]
+        with ProcessPoolExecutor(workers) as executor:
+            chunks = executor.map(detect_chunk, repeat(self.config),
+                                  repeat(self.source), starts, stops)
+            for start, stop, (chunk, stages) in zip(starts, stops, chunks):
+                profiler.merge(stages)
+                yield from chunk
+                if stop is not None and len(chunk) < stop - start:
+                    break  # El video terminó antes de lo esperado.
+
+    def find_walks(self, pqueue=None, onwalk=None):
+        u"""Encuentra las caminatas dentro de un video.
+
+        Si se indica onwalk, se llama con cada caminata en cuanto se cierra,
+        mientras continúa la búsqueda en el resto del video. Si onwalk falla,
+        el error se registra y la búsqueda continúa sin llamarlo más.
+        """
+        pos = 0
+        try:
+            with profiler.stage('find_walks') as stage:
+                pos = self._find_walks(pqueue, onwalk)
+                stage.frames = pos
+        finally:
+            # El que espera el progreso no debe quedar bloqueado si hay error.
+            if pqueue:
+                pqueue.put(pos)
+                pqueue.put(-1)
+
+    def _find_walks(self, pqueue, onwalk):
         self.walks.clear()
         walking = False
-        while True:
-            ret, pos, frame = self.video.read_frame()
-            if not ret:
-                break
-            n, conts = self.video.contours(frame)
-            centers = self.video.centers(conts)
-            fullschema = (n == self.config.getint('schema', 'n'))
+        pos = 0
+        nmarkers = self.config.getint('schema', 'n')
+        for pos, n, centers in self.detections():
+            fullschema = (n == nmarkers)
             if not walking:
                 if fullschema:
                     walk = self.new_walk()
@@ -184,12 +597,17 @@ class Explorer(object):
                 if n == 0:
                     walk.append_stop()
                     walking = False
+                    if onwalk:
+                        try:
+                            onwalk(walk)
+                        except Exception:
+                            # Las caminatas restantes se procesan al final.
+                            logging.exception("Error procesando %s", walk)
+                            onwalk = None
                     if pqueue:
                         pqueue.put(pos)
                         sleep(0.00001)
-        if pqueue:
-            pqueue.put(pos)
-            pqueue.put(-1)
+        return pos
 
     def preview(self, delay):
         self.video.view("preview", delay)
@@ -198,18 +616,105 @@ class Explorer(object):
         self.video.view("walk", delay, walk)
 
 
+def foot_order():
+    u"""Tabla del orden de los marcadores de pie (a, b, c).
+
+    Los segmentos ab, bc y ca se ordenan por longitud; el primer marcador es el
+    común al segmento más corto y al más largo, el segundo el común al más
+    corto y al intermedio, y el tercero el común al intermedio y al más largo.
+    La fila de la tabla es 3 * (más corto) + (intermedio).
+    """
+    segments = ((0, 1), (1, 2), (2, 0))
+    table = np.zeros((9, 3), dtype=np.intp)
+    for shortest, middle, longest in permutations(range(3)):
+        A, B, C = [set(segments[i]) for i in (shortest, middle, longest)]
+        table[shortest * 3 + middle] = ((A & C).pop(), (A & B).pop(),
+                                        (B & C).pop())
+    return table
+
+
+FOOT_ORDER = foot_order()
+
+
+def grow(array, nrows):
+    u"""Devuelve el arreglo con lugar para al menos nrows filas.
+
+    Si no alcanza el lugar, se copia a un arreglo del doble de filas, de manera
+    que agregar filas de a una tiene un costo constante amortizado.
+    """
+    if nrows <= array.shape[0]:
+        return array
+    capacity = max(nrows, 2 * array.shape[0])
+    grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:array.shape[0]] = array
+    return grown
+
+
+class WalkLayout(object):
+    u"""Ubicación de las columnas en el arreglo de la caminata.
+
+    Los índices se calculan una sola vez por esquema de marcadores y todas las
+    caminatas del mismo esquema comparten la misma instancia (de sólo lectura).
+    """
+    _layouts = {}
+
+    def __init__(self, n, r, markersxroi):
+        self.cols = (1, 1, n*2, r*4, r)
+        self.markersxroi = tuple(tuple(int(x) for x in tup.split(','))
+                                 for tup in markersxroi.split('/'))
+        starts = np.cumsum((0,) + self.cols)
+        imks = np.arange(n) * 2 + starts[2]
+        iregions = np.arange(r) * 4 + starts[3]
+        self.ixmarkers = self.readonly(imks[list(m)] for m in self.markersxroi)
+        self.iymarkers = self.readonly(imks[list(m)] + 1
+                                       for m in self.markersxroi)
+        self.imarkers = self.readonly(
+            np.vstack((x, y)).transpose().flatten()
+            for x, y in zip(self.ixmarkers, self.iymarkers))
+        self.ixregion = self.readonly(np.array((i, i + 2)) for i in iregions)
+        self.iyregion = self.readonly(np.array((i + 1, i + 3))
+                                      for i in iregions)
+        self.iincompleted, = self.readonly((np.arange(r) + starts[4],))
+        self.markers = slice(starts[2], starts[3])
+        self.regions = slice(starts[3], starts[4])
+        self.incompleted = slice(starts[4], starts[5])
+        self.ncols = starts[5]
+
+    @staticmethod
+    def readonly(arrays):
+        out = []
+        for array in arrays:
+            array.setflags(write=False)
+            out.append(array)
+        return tuple(out)
+
+    @classmethod
+    def from_config(cls, config):
+        u"""Devuelve la ubicación de columnas del esquema de la configuración."""
+        key = (config.getint('schema', 'n'), config.getint('schema', 'r'),
+               config.get('schema', 'markersxroi'))
+        if key not in cls._layouts:
+            cls._layouts[key] = cls(*key)
+        return cls._layouts[key]
+
+
 class Walk(object):
-    maxsize = 2500
+    chunksize = 256
 
     def __init__(self, id, config):
         self.id = id
         self.config = config
-        mplaces = config.getint('schema', 'n')
-        rplaces = config.getint('schema', 'r')
-        self._cols = (1, 1, mplaces*2, rplaces*4, rplaces)
-        self._array = np.zeros((self.maxsize, sum(self._cols)), dtype=np.int16)
+        self.layout = WalkLayout.from_config(config)
+        self._cols = self.layout.cols
+        self._buffer = np.zeros((self.chunksize, self.layout.ncols), np.int16)
+        self._array = self._buffer[:0]
         self._currow = 0
-        self._incompleted = []
+        # Los centros de los cuadros incompletos se guardan uno a continuación
+        # del otro; el cuadro i ocupa las filas _incoffsets[i: i+2].
+        self._incvalues = np.zeros((self.chunksize, 2), dtype=np.int16)
+        self._incoffsets = np.zeros(self.chunksize, dtype=np.int64)
+        self._nincompleted = 0
+        self.processed = False
 
     def __repr__(self):
         return 'W{0}'.format(self.id)
@@ -228,83 +733,75 @@ class Walk(object):
 
     @property
     def markersxroi(self):
-        out = []
-        stringtuple = self.config.get('schema', 'markersxroi')
-        for tup in stringtuple.split('/'):
-            stringvector = tup.split(',')
-            out.append([int(x) for x in stringvector])
-        return(out)
+        return self.layout.markersxroi
 
     @property
     def ixmarkers(self):
-        r0, r1, r2 = self.markersxroi
-        nmarkers = self.config.getint('schema', 'n')
-        imks = np.arange(nmarkers) * 2 + sum(self._cols[:2])
-        return imks[r0,], imks[r1,], imks[r2,]
+        return self.layout.ixmarkers
 
     @property
     def iymarkers(self):
-        r0, r1, r2 = self.markersxroi
-        nmarkers = self.config.getint('schema', 'n')
-        imks = np.arange(nmarkers) * 2 + sum(self._cols[:2]) + 1
-        return imks[r0,], imks[r1,], imks[r2,]
+        return self.layout.iymarkers
 
     @property
     def imarkers(self):
-        array = []
-        for x, y in zip(self.ixmarkers, self.iymarkers):
-            array.append(np.vstack((x, y)).transpose().flatten())
-        return array
+        return self.layout.imarkers
 
     @property
-
     def ixregion(self):
-        r0 = np.arange(2) * 2 + sum(self._cols[:3])
-        r1 = np.arange(2) * 2 + sum(self._cols[:3]) + 4
-        r2 = np.arange(2) * 2 + sum(self._cols[:3]) + 8
-        return r0, r1, r2
+        return self.layout.ixregion
 
     @property
-
     def iyregion(self):
-        r0 = np.arange(2) * 2 + sum(self._cols[:3]) + 1
-        r1 = np.arange(2) * 2 + sum(self._cols[:3]) + 5
-        r2 = np.arange(2) * 2 + sum(self._cols[:3]) + 9
-        return r0, r1, r2
+        return self.layout.iyregion
 
     @property
     def iincompleted(self):
-        return np.arange(self.config.getint('schema','r')) + sum(self._cols[:4])
+        return self.layout.iincompleted
 
     @property
     def arrincompleted(self):
-        return self._array[:, self.iincompleted]
+        return self._array[:, self.layout.incompleted]
 
     @property
     def regions(self):
-        cols = np.arange(self._cols[3]) + sum(self._cols[:3])
-        return self._array[:, cols].reshape(self._array.shape[0], 3, 2, 2)
+        regions = self._array[:, self.layout.regions]
+        return regions.reshape(self._array.shape[0], -1, 2, 2)
 
     @property
     def markers(self):
-        cols = np.arange(self._cols[2]) + sum(self._cols[:2])
-        return self._array[:, cols]
+        return self._array[:, self.layout.markers]
+
+    @property
+    def incompleted(self):
+        u"""Centros de cada uno de los cuadros incompletos."""
+        offsets = self._incoffsets[:self._nincompleted + 1]
+        return [self._incvalues[i: j] for i, j in zip(offsets[:-1], offsets[1:])]
 
     def append_centers(self, pos, fullschema, centers):
         u"""Agrega información del cuadro de video."""
+        self._buffer = grow(self._buffer, self._currow + 1)
         if fullschema:
             data = np.hstack((pos, fullschema, centers.flatten()))
-            self._array[self._currow, np.arange(sum(self._cols[:3]))] = data
+            self._buffer[self._currow, :sum(self._cols[:3])] = data
         else:
             data = (pos, fullschema)
-            self._incompleted.append(centers)
-            self._array[self._currow, np.arange(sum(self._cols[:2]))] = data
+            self._buffer[self._currow, :sum(self._cols[:2])] = data
+            values = centers.reshape(-1, 2)
+            start = self._incoffsets[self._nincompleted]
+            stop = start + values.shape[0]
+            self._incvalues = grow(self._incvalues, stop)
+            self._incvalues[start: stop] = values
+            self._nincompleted += 1
+            self._incoffsets = grow(self._incoffsets, self._nincompleted + 1)
+            self._incoffsets[self._nincompleted] = stop
         self._currow += 1
+        self._array = self._buffer[:self._currow]
 
     def append_stop(self):
         u"""Cierra la información de cuadros en la caminata."""
-        lastcompleted = self.arrnrows[np.bool8(self.arrcompleted)][-1]
-        self._array = self._array[:lastcompleted+1]
+        lastcompleted = np.flatnonzero(self.arrcompleted)[-1]
+        self._array = self._buffer[:lastcompleted+1]
 
     def calculate_regions(self):
         u"""Encuentra las regiones de interes del esquema de marcadores."""
@@ -321,61 +818,72 @@ class Walk(object):
 
     def interpolate_regions(self):
         u"""Crea las regiones de interes de los cuadros incompletos"""
-        comp = self.arrnrows[np.bool8(self.arrcompleted)]
-        inco = self.arrnrows[np.logical_not(np.bool8(self.arrcompleted))]
+        comp = self.arrnrows[np.bool_(self.arrcompleted)]
+        inco = self.arrnrows[np.logical_not(np.bool_(self.arrcompleted))]
         regions = np.hstack(self.ixregion), np.hstack(self.iyregion)
         for r in np.hstack(regions):
             self._array[inco, r] = np.interp(inco, comp, self._array[comp, r])
 
     def recover_incompleted(self):
-        incompleted = []
-        axis = self.arrnrows[np.logical_not(self.arrcompleted)]
-        for pos, centers in zip(axis, self._incompleted):
-            xm = centers[:, 0]
-            ym = centers[:, 1]
-            for r, (ix, iy) in enumerate(zip(self.ixregion, self.iyregion)):
-                x0, x1 = self._array[pos, ix]
-                x = np.logical_and(xm > x0, xm < x1)
-                y0, y1 = self._array[pos, iy]
-                y = np.logical_and(ym > y0, ym < y1)
-                substitution = centers[np.logical_and(x, y)]
-                if len(substitution) == len(self.markersxroi[r]):
-                    self._array[pos, self.imarkers[r]] = substitution.flatten()
-                    incompleted.append(0)
-                else:
-                    incompleted.append(1)
-            self._array[pos, self.iincompleted] = incompleted
-            incompleted.clear()
+        u"""Recupera los marcadores de los cuadros incompletos.
+
+        Los centros de todos los cuadros incompletos se ordenan en un arreglo
+        (cuadros, centros, 2) completado con ceros, y se comparan a la vez con
+        las regiones de cada cuadro. Una región se recupera cuando contiene
+        exactamente la cantidad de marcadores que le corresponde.
+        """
+        axis = np.flatnonzero(self.arrcompleted == 0)
+        nframes = min(axis.size, self._nincompleted)
+        if not nframes:
+            return
+        axis = axis[:nframes]
+        offsets = self._incoffsets[:nframes + 1]
+        counts = np.diff(offsets)
+        valid = np.arange(counts.max()) < counts[:, np.newaxis]
+        centers = np.zeros(valid.shape + (2,), dtype=np.int16)
+        centers[valid] = self._incvalues[offsets[0]: offsets[-1]]
+
+        rows = self._array[axis]
+        x0, x1 = np.moveaxis(rows[:, np.array(self.ixregion)], -1, 0)
+        y0, y1 = np.moveaxis(rows[:, np.array(self.iyregion)], -1, 0)
+        xm = centers[:, np.newaxis, :, 0]
+        ym = centers[:, np.newaxis, :, 1]
+        # inside[cuadro, región, centro]
+        inside = ((xm > x0[..., np.newaxis]) & (xm < x1[..., np.newaxis]) &
+                  (ym > y0[..., np.newaxis]) & (ym < y1[..., np.newaxis]) &
+                  valid[:, np.newaxis, :])
+        ninside = inside.sum(axis=-1)
+
+        incompleted = np.ones(ninside.shape, dtype=np.int16)
+        for r, imarkers in enumerate(self.imarkers):
+            nmarkers = len(self.markersxroi[r])
+            recovered = np.flatnonzero(ninside[:, r] == nmarkers)
+            # Los centros de la región, en el orden en que fueron detectados.
+            order = np.argsort(~inside[recovered, r], axis=1, kind='stable')
+            substitution = centers[recovered[:, np.newaxis],
+                                   order[:, :nmarkers]]
+            self._array[axis[recovered, np.newaxis], imarkers] = \
+                substitution.reshape(recovered.size, nmarkers * 2)
+            incompleted[recovered, r] = 0
+        self._array[axis[:, np.newaxis], self.iincompleted] = incompleted
 
     def sort_foot(self):
         u"""ordena los marcadores de pie."""
-        indexes = np.array(self.markersxroi[2])
-        # El 2 es por las dos primeras columnas del arreglo
-        x = 2 + indexes * 2
-        y = 2 + indexes * 2 + 1
-
-        indexes = np.array((x, y)).transpose()
-        ia, ib, ic = indexes
+        indexes = np.array((self.ixmarkers[-1], self.iymarkers[-1])).transpose()
         ma, mb, mc = [self._array[:, xy] for xy in indexes]
 
         segments = np.array((ma-mb, mb-mc, mc-ma))
-        sequence = np.array(((ia, ib), (ib, ic), (ic, ia)))
         distances = np.linalg.norm(segments, axis=2).transpose()
 
         ordered_distances = np.argsort(distances)
-        ordered_indexes = []
-        for row in sequence[ordered_distances]:
-            A, B, C = row
-            ia = np.intersect1d(A, C)
-            ib = np.intersect1d(A, B)
-            ic = np.intersect1d(B, C)
-            ordered_indexes.append(np.hstack((ia, ib, ic)))
-        for r, ix in enumerate(ordered_indexes):
-            self._array[r, indexes.flatten()] = self._array[r, ix]
+        order = FOOT_ORDER[ordered_distances[:, 0] * 3 + ordered_distances[:, 1]]
+        ordered_indexes = indexes[order].reshape(order.shape[0], -1)
+        rows = self.arrnrows[:, np.newaxis]
+        self._array[rows, indexes.flatten()] = self._array[rows, ordered_indexes]
 
     def interpolate_markers(self):
         for r, (mx, my) in enumerate(zip(self.ixmarkers, self.iymarkers)):
-            indexes = np.bool8(self.arrincompleted[:, r])
+            indexes = np.bool_(self.arrincompleted[:, r])
             comp = self.arrnrows[np.logical_not(indexes)]
             inco = self.arrnrows[indexes]
             for m in np.hstack((mx, my)):
@@ -393,11 +901,15 @@ class Walk(object):
         return self.direction
 
     def find_markers(self):
-        self.calculate_regions()
-        self.interpolate_regions()
-        self.recover_incompleted()
-        self.sort_foot()
-        self.interpolate_markers()
+        if self.processed:
+            return
+        with profiler.stage('find_markers', frames=self._array.shape[0]):
+            self.calculate_regions()
+            self.interpolate_regions()
+            self.recover_incompleted()
+            self.sort_foot()
+            self.interpolate_markers()
+        self.processed = True
 
 
 class Pics(Video):
@@ -438,8 +950,8 @@ class Pics(Video):
 
     def frame_from_cycle(self, posframe):
         u"""Devuelve el cuadro (imagen) en la posción que se le indica."""
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, posframe)
-        frame = cv2.resize(self.cap.read()[1], (self.width, self.height))
+        self.seek(posframe)
+        frame = cv2.resize(self.read_frame()[2], (self.width, self.height))
         return frame
 
     def build_pic(self, cframes):
@@ -453,12 +965,55 @@ class Pics(Video):
         destpath = os.path.join(self.config.get("current", "pics"), name)
         cv2.imwrite(u"%s.png" % destpath, image)
 
-    def make_pics(self, cycles, walks):
-        """Genera las pics de fase por cada ciclo."""
-        for cycle in cycles:
+    def plan(self, cycles, walks):
+        u"""Cuadros que necesitan las pics, para leerlos en una sola pasada.
+
+        Devuelve {cuadro: [(pic, subimagen), ...]}, con la posición absoluta
+        del cuadro en el video, y por cada pic su nombre y los centros de sus
+        subimágenes.
+        """
+        requests = {}
+        pics = []
+        for n, cycle in enumerate(cycles):
             walk = walks[cycle[1]]  # walk_id
             centers = [self.calc_xcenter(walk, pos) for pos in cycle[3:]]
-            frames = [self.frame_from_cycle(c) for c in cycle[3:] + walk.info[1]]  # absolute frame position
-            cutted = [self.cut_frame(f, c) for f, c in zip(frames, centers)]
-            pic = self.build_pic(cutted)
-            self.save(pic, "W%dC%d" % (cycle[1], cycle[0]))
+            pics.append(("W%dC%d" % (cycle[1], cycle[0]), centers))
+            # absolute frame position
+            for slot, frame in enumerate(cycle[3:] + walk.info[1]):
+                requests.setdefault(int(frame), []).append((n, slot))
+        return requests, pics
+
+    def make_pics(self, cycles, walks):
+        """Genera las pics de fase por cada ciclo.
+
+        Los cuadros se decodifican en orden, en una sola pasada desde el
+        primero que se necesita, en lugar de ubicar la captura en cada uno.
+        Cada pic se arma apenas se leen sus cuadros y se guarda en otro hilo.
+        """
+        requests, pics = self.plan(cycles, walks)
+        if not requests:
+            return
+        cutted = [[None] * len(centers) for __, centers in pics]
+        missing = [len(centers) for __, centers in pics]
+        first, last = min(requests), max(requests)
+        workers = self.config.getint('video', 'picworkers', fallback=2)
+        with profiler.stage('pics', cycles=len(cycles)), \
+                ThreadPoolExecutor(max(1, workers)) as executor:
+            # pos cuenta los cuadros leídos: el cuadro actual es pos - 1.
+            saved = []
+            for pos, frame in self.frames(first, last + 1):
+                if pos - 1 not in requests:
+                    continue
+                frame = cv2.resize(frame, (self.width, self.height))
+                for n, slot in requests[pos - 1]:
+                    cutted[n][slot] = self.cut_frame(frame, pics[n][1][slot])
+                    missing[n] -= 1
+                    if not missing[n]:
+                        saved.append(executor.submit(
+                            self.save, self.build_pic(cutted[n]), pics[n][0]))
+                        cutted[n] = None
+            for future in saved:
+                future.result()
+        incomplete = [name for (name, __), m in zip(pics, missing) if m]
+        if incomplete:
+            logging.warning("Faltan cuadros para las pics %s", incomplete)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""Comparación de velocidad de los métodos de detección de marcadores.
+
+Uso: python test/benchdetection.py [video]
+
+Sin argumentos se utilizan cuadros sintéticos de 1920x1080 con siete
+marcadores; con un video se utilizan sus primeros cuadros. Para las
+detecciones a resolución reducida se informa además la diferencia con la
+detección a resolución completa.
+"""
+
+# Copyright (C) 2019  Mariano Ramis
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+from time import perf_counter
+from configparser import ConfigParser
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'src'))
+import video
+
+
+cstring = """
+[explorer]
+dilate = False
+threshold = 240
+backend = contours
+scale = 1
+channel = gray
+"""
+
+nframes = 200
+
+
+def synthetic_frames(width=1920, height=1080):
+    frames = []
+    ypos = np.linspace(100, height - 100, 7)
+    for f in range(nframes):
+        frame = np.full((height, width, 3), 30, np.uint8)
+        for i, y in enumerate(ypos):
+            x = int(200 + f * 5 + 30 * np.sin(f / 10 + i))
+            cv2.circle(frame, (x, int(y)), 12, (255, 255, 255), -1)
+        frames.append(frame)
+    return frames
+
+
+def video_frames(path):
+    frames = []
+    cap = cv2.VideoCapture(path)
+    while len(frames) < nframes:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def bench(frames, **options):
+    config = ConfigParser()
+    config.read_string(cstring)
+    for key, value in options.items():
+        config.set('explorer', key, value)
+    vid = video.Video(config)
+    t0 = perf_counter()
+    detections = [vid.detect(frame) for frame in frames]
+    return len(frames) / (perf_counter() - t0), detections
+
+
+def error(reference, detections):
+    u"""Diferencia de los centros respecto de la detección de referencia."""
+    distances = []
+    missed = 0
+    for (n, centers), (rn, rcenters) in zip(detections, reference):
+        if n != rn:
+            missed += 1
+        elif n:
+            diff = centers.astype(float) - rcenters
+            distances.extend(np.linalg.norm(diff, axis=1))
+    if not distances:
+        return missed, np.nan, np.nan
+    return missed, np.mean(distances), np.max(distances)
+
+
+if __name__ == '__main__':
+    frames = video_frames(sys.argv[1]) if sys.argv[1:] else synthetic_frames()
+    height, width = frames[0].shape[:2]
+    print('%d cuadros de %dx%d' % (len(frames), width, height))
+    for backend in ('contours', 'components'):
+        for dilate in ('False', 'True'):
+            fps, __ = bench(frames, backend=backend, dilate=dilate)
+            print('backend=%-10s dilate=%-5s %8.1f cuadros/s' %
+                  (backend, dilate, fps))
+    __, reference = bench(frames)
+    for channel in ('gray', 'green'):
+        for scale in ('1', '0.5', '0.25'):
+            fps, detections = bench(frames, channel=channel, scale=scale)
+            missed, mean, maximum = error(reference, detections)
+            print('channel=%-5s scale=%-4s %8.1f cuadros/s  cuadros con otro '
+                  'n: %d  error medio: %.2f px  máximo: %.2f px' %
+                  (channel, scale, fps, missed, mean, maximum))
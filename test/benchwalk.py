@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""Tiempo de procesamiento de los marcadores de una caminata.
+
+Uso: python test/benchwalk.py [cuadros]
+
+Construye una caminata sintética (2000 cuadros por defecto) con cuadros
+incompletos y mide Walk.find_markers y cada una de sus etapas.
+"""
+
+# Copyright (C) 2019  Mariano Ramis
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+from time import perf_counter
+from configparser import ConfigParser
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'src'))
+import video
+
+
+cstring = """
+[walk]
+roiwidth = 125
+roiheight = 35
+
+[schema]
+n = 7
+r = 3
+foot = 5,6
+markersxroi = 0,1/2,3/4,5,6
+"""
+
+config = ConfigParser()
+config.read_string(cstring)
+
+stages = ('calculate_regions', 'interpolate_regions', 'recover_incompleted',
+          'sort_foot', 'interpolate_markers')
+
+
+def synthetic_walk(nframes, seed=0):
+    u"""Caminata con un 30% de cuadros incompletos y marcadores espurios."""
+    rng = np.random.RandomState(seed)
+    walk = video.Walk(0, config)
+    ypos = np.array((60, 120, 170, 250, 330, 420, 430))
+    xpos = np.array((0, 5, 10, 15, 20, 0, 40))
+    foot = np.arange(7) > 4
+    for f in range(nframes):
+        x = f + xpos + np.where(foot, 25 * np.sin(f / 8 + rng.rand()), 0)
+        y = ypos + rng.randint(-3, 4, 7)
+        centers = np.array((x, y), dtype=np.int16).transpose()
+        if 0 < f < nframes - 1 and rng.rand() < .3:
+            hidden = rng.choice(7, rng.randint(1, 4), replace=False)
+            centers = np.delete(centers, hidden, axis=0)
+            if rng.rand() < .3:
+                centers = np.vstack((centers, (x[0] + 30, 80)))
+            walk.append_centers(f + 1, False, centers.astype(np.int16))
+        else:
+            walk.append_centers(f + 1, True, centers)
+    walk.append_centers(nframes + 1, False, np.array([], dtype=np.int16))
+    walk.append_stop()
+    return walk
+
+
+def timeit(function, repeat=5):
+    best = np.inf
+    for __ in range(repeat):
+        t0 = perf_counter()
+        function()
+        best = min(best, perf_counter() - t0)
+    return best * 1000
+
+
+if __name__ == '__main__':
+    nframes = int(sys.argv[1]) if sys.argv[1:] else 2000
+    walks = [synthetic_walk(nframes) for __ in range(5)]
+    print('find_markers (%d cuadros): %.2f ms' %
+          (nframes, timeit(lambda: walks.pop().find_markers())))
+    walk = synthetic_walk(nframes)
+    for stage in stages:
+        print('  %-20s %8.2f ms' % (stage, timeit(getattr(walk, stage), 1)))
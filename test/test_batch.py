@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""Docstring."""
+
+# Copyright (C) 2019  Mariano Ramis
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import csv
+import sys
+import shutil
+import tempfile
+
+from configparser import ConfigParser
+
+sys.path.insert(0, os.path.abspath('.'))
+from src import batch, settings
+from test_video import make_video
+
+
+def make_config():
+    config = ConfigParser()
+    config.read_string(settings.DEFAULT_CONFIG.format(
+        APP='', HOME='', NORMAL=settings.NORMAL_DIR))
+    return config
+
+
+def test_find_videos():
+    tmpdir = tempfile.mkdtemp()
+    for name in ('b.avi', 'a.MP4', 'notas.txt'):
+        open(os.path.join(tmpdir, name), 'w').close()
+    videos = batch.find_videos([tmpdir, os.path.join(tmpdir, 'notas.txt'),
+                                os.path.join(tmpdir, 'no-existe.avi')])
+    assert [os.path.basename(v) for v in videos] == ['a.MP4', 'b.avi', 'notas.txt']
+    # El mismo archivo por dos caminos se procesa una vez.
+    assert batch.find_videos([tmpdir, os.path.join(tmpdir, 'b.avi')]) == videos[:2]
+    shutil.rmtree(tmpdir)
+
+
+def test_session_names():
+    videos = [os.path.join('camara1', 'VID_0001.mp4'),
+              os.path.join('camara2', 'VID_0001.mp4'),
+              os.path.join('otra', 'camara1', 'VID_0001.mp4'),
+              os.path.join('camara1', 'VID_0002.mp4')]
+    assert batch.session_names(videos) == [
+        'camara1-VID_0001.mp4', 'camara2-VID_0001.mp4',
+        'camara1-VID_0001.mp4-2', 'VID_0002.mp4']
+
+
+def test_analyze(monkeypatch):
+    tmpdir = tempfile.mkdtemp()
+    monkeypatch.setattr(settings, 'SESSION_DIR', os.path.join(tmpdir, 'sesiones'))
+    os.mkdir(settings.SESSION_DIR)
+    source = os.path.join(tmpdir, 'captura.avi')
+    make_video(source)
+    summary = batch.analyze(make_config(), source)
+    assert summary['error'] == ''
+    assert summary['walks'] == 2
+    assert summary['session'] == os.path.join(settings.SESSION_DIR, 'captura.avi')
+    assert os.path.isdir(os.path.join(summary['session'], 'walks'))
+    assert 'Rango de movimiento.png' in os.listdir(summary['session'])
+
+    summary = batch.analyze(make_config(), os.path.join(tmpdir, 'otra.avi'))
+    assert summary['error']
+
+    path = os.path.join(tmpdir, 'resumen.csv')
+    batch.write_summary([summary], path)
+    with open(path) as fh:
+        rows = list(csv.DictReader(fh))
+    assert rows[0]['source'] == summary['source']
+    shutil.rmtree(tmpdir)
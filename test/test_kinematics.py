@@ -82,6 +82,22 @@ walk.id = 1
 # #
 
 
+def test_parameters():
+    params = kinematics.Parameters.from_config(config)
+    assert params.cyclemarkers == ((10, 11), (12, 13))
+    assert params.segment('leg') == (3, 4)
+    assert [s for s, __ in params.segments] == ['tight', 'leg', 'foot']
+    assert params.fps == 60
+    kine = kinematics.Kinematics(config)
+    config.set('kinematics', 'leftthreshold', '3.2')
+    assert kine.footvelocitythreshold == (.17, .23)
+    kine.invalidate()
+    config.read_string(cstring)
+    assert kine.footvelocitythreshold == (3.2, .23)
+    kine.start()
+    assert kine.cycler.params is kine.stp.params is kine.params
+
+
 def test_cycler():
     cyclemarkers = (10, 11), (12, 13)
     threshold = (.15, .17)
@@ -91,6 +107,242 @@ def test_cycler():
     cycler.filter_by_duration()
 
 
+def test_cycler_events():
+    cycler = kinematics.Cycler(config)
+    for __ in range(20):
+        footmotion = np.random.random(300) > .5
+        expected = []
+        strike = []
+        for i, (prev, next) in enumerate(zip(footmotion[:-1], footmotion[1:])):
+            if prev and not next:
+                strike.append(i+1)
+            if not prev and next:
+                toe_off = i+1
+            if len(strike) == 2:
+                expected.append((strike[0], toe_off, strike[1]))
+                strike.pop(0)
+        cycles = cycler.cycler(footmotion)
+        assert np.array_equal(cycles.reshape(-1, 3), np.array(expected).reshape(-1, 3))
+
+
+def step_walk(wid=0):
+    u"""Caminata con 10 ciclos bien definidos en los marcadores de pie."""
+    t = np.arange(600)
+    steps = (t // 50) * 150 + np.clip(t % 50 - 25, 0, None) * 14
+    markers = np.repeat(t * 3., 14).reshape(600, 14)
+    markers[:, 10] = steps + np.random.random(600)
+    markers[:, 12] = steps + 30 + np.random.random(600)
+    stepwalk = mock.Mock()
+    stepwalk.markers = markers
+    stepwalk.dir = 0
+    stepwalk.id = wid
+    return stepwalk
+
+
+def test_soft_foot_velocity():
+    u"""El suavizado por defecto no modifica los ciclos encontrados."""
+    def reference(array, loops=8):
+        index = np.arange(array.shape[1])
+        for __ in range(loops):
+            for i, j, k in zip(index[:-1], index[1:-1], index[2:]):
+                array[:, j] = (array[:, i] + array[:, k]) / 2
+        return array
+
+    stepwalk = step_walk()
+    markers = stepwalk.markers
+
+    cyclemarkers = (10, 11), (12, 13)
+    threshold = (3.2, 3.2)
+    cycler = kinematics.Cycler(config)
+    cycler.find_cycles(stepwalk, cyclemarkers, threshold)
+    cycler.stop()
+    __, velocity, motion = cycler.movement[0]
+
+    footmarkers = markers[:, (10, 11)], markers[:, (12, 13)]
+    expected = reference(np.abs(np.diff(footmarkers, axis=1).mean(2)))
+    assert np.allclose(velocity, expected, rtol=1e-12)
+    expected = cycler.cycler(np.logical_and(*(expected >= threshold[0])))
+    assert len(expected) == 10
+    assert np.array_equal(cycler.cyclessv[:, 3:], expected)
+
+
+def test_resize_cycles():
+    cycler = kinematics.Cycler(config)
+    starts, stops = np.array((0, 20, 45)), np.array((20, 45, 100))
+    resized = cycler.resize_cycles(mockarray, starts, stops)
+    for cycle, (c1, c3) in zip(resized, zip(starts, stops)):
+        domain = np.linspace(0, c3 - c1, cycler.nfix)
+        for column, values in zip(cycle.transpose(), mockarray[c1:c3].transpose()):
+            assert np.allclose(column, np.interp(domain, np.arange(c3 - c1), values))
+    cycler.resampling = 'spline'
+    out = np.zeros((3, cycler.nfix, 14))
+    cycler.resize_cycles(np.ones((100, 14)), starts, stops, out=out)
+    assert np.allclose(out, 1)
+    # Catmull-Rom reproduce exactamente una cuadrática lejos de los bordes.
+    t = np.arange(100, dtype=float)
+    quadratic = np.tile((3 * t**2 - 7 * t + 2)[:, np.newaxis], (1, 14))
+    resized = cycler.resize_cycles(quadratic, starts, stops)
+    for cycle, (c1, c3) in zip(resized, zip(starts, stops)):
+        domain = np.linspace(0, c3 - c1, cycler.nfix)
+        x = c1 + domain
+        interior = np.logical_and(domain >= 1, domain <= c3 - c1 - 3)
+        assert np.allclose(cycle[interior, 0], (3 * x**2 - 7 * x + 2)[interior])
+    # Comparación con la fórmula de Catmull-Rom, muestra a muestra.
+    c1, c3 = starts[1], stops[1]
+    values = mockarray[c1:c3, 0].astype(float)
+    domain = np.minimum(np.linspace(0, c3 - c1, cycler.nfix), c3 - c1 - 1)
+    for x, result in zip(domain,
+                         cycler.resize_cycles(mockarray, starts, stops)[1, :, 0]):
+        i = int(x)
+        p0, p1, p2, p3 = values[np.clip((i - 1, i, i + 1, i + 2), 0, c3 - c1 - 1)]
+        f = x - i
+        expected = 0.5 * (2 * p1 + (p2 - p0) * f +
+                          (2 * p0 - 5 * p1 + 4 * p2 - p3) * f**2 +
+                          (3 * p1 - p0 - 3 * p2 + p3) * f**3)
+        assert np.isclose(result, expected)
+
+
+def test_cycler_capacity():
+    u"""Los contenedores crecen más allá de maxcycles."""
+    small = ConfigParser()
+    small.read_string(cstring)
+    small.set('kinematics', 'maxcycles', '2')
+    small.set('kinematics', 'dtype', 'float32')
+    cycler = kinematics.Cycler(small)
+    cyclemarkers = (10, 11), (12, 13)
+    threshold = (3.2, 3.2)
+    for wid in range(5):
+        cycler.find_cycles(step_walk(wid), cyclemarkers, threshold)
+    cycler.stop()
+    ncycles = cycler.counter
+    assert ncycles == 50
+    assert cycler.cyclessv.shape[0] == cycler.cyclesmk.shape[0] == ncycles
+    assert np.array_equal(cycler.cyclessv[::10, 1], np.arange(5))
+    assert np.array_equal(cycler.cyclessv[:, 0], np.arange(ncycles))
+    assert cycler.cyclesmk.dtype == np.float32
+    assert np.shares_memory(cycler.cyclesmk, cycler._mk)
+
+
+def test_angles():
+    ncycles, nrows = 30, 64
+    A = np.random.random((ncycles, nrows, 2)) - .5
+    B = np.random.random((ncycles, nrows, 2)) - .5
+    angles = kinematics.Angles()
+    expected = [np.degrees(np.arccos(np.sum(a * b, 1) / (
+        np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)))) for a, b in zip(A, B)]
+    assert np.allclose(angles.angle(A, B), expected)
+    # Un segmento de longitud nula no tiene ángulo.
+    A[3, 5] = 0
+    B[7, 2] = 0
+    result = angles.angle(A, B)
+    assert np.isnan(result[3, 5]) and np.isnan(result[7, 2])
+    assert np.count_nonzero(np.isnan(result)) == 2
+
+    direction = np.random.randint(0, 2, ncycles)
+    canonical = angles.canonicalX(direction, nrows)
+    assert canonical.shape == (ncycles, nrows, 2)
+    assert np.array_equal(canonical[:, 0, 0], np.where(direction, 1, -1))
+    segments = np.random.random((ncycles, nrows, 6))
+    assert angles.calculate(segments, direction).shape == (3, ncycles, nrows)
+
+
+def test_push_walk():
+    u"""Procesar las caminatas a medida que se cierran equivale al lote."""
+    config.set('kinematics', 'filter_by_duration', 'True')
+    walks = [step_walk(wid) for wid in range(4)]
+    for walk in walks[1:]:
+        walk.markers = walk.markers[:300 + 50 * walk.id]
+    # En lote: primero todos los ciclos, luego los parámetros.
+    batch = kinematics.Kinematics(config)
+    for walk in walks:
+        batch.cycler.find_cycles(walk, batch.cyclemarkers, batch.footvelocitythreshold)
+    batch.cycler.stop()
+    streaming = kinematics.Kinematics(config)
+    for walk in walks:
+        streaming.push_walk(walk)
+    streaming.push_walk(walks[0])
+    streaming.cycle_walks(walks)
+    config.set('kinematics', 'filter_by_duration', 'False')
+    assert streaming.cycler.counter == batch.cycler.counter
+    assert np.array_equal(streaming.cycler.cyclessv, batch.cycler.cyclessv)
+    expected, result = batch.to_plot(), streaming.to_plot()
+    assert np.array_equal(expected[0], result[0])
+    assert np.allclose(expected[2][:, 1:], result[2][:, 1:])
+    for joint, sjoint in zip(expected[3:], result[3:]):
+        assert np.allclose(joint, sjoint)
+
+
+def test_delete_cycles():
+    u"""Los promedios se actualizan al eliminar ciclos."""
+    walks = [step_walk(wid) for wid in range(4)]
+    walks[1].dir = walks[3].dir = 1
+    for walk in walks:
+        walk.markers += np.arange(14) * 10  # Segmentos de longitud no nula.
+    stepconfig = ConfigParser()
+    stepconfig.read_string(cstring)
+    stepconfig.set('kinematics', 'leftthreshold', '3.2')
+    stepconfig.set('kinematics', 'rightthreshold', '3.2')
+    kine = kinematics.Kinematics(stepconfig)
+    kine.cycle_walks(walks)
+    ncycles = kine.cycler.counter
+    kine.delete_cycles(['3', '12', '12', '35', 'W0'])
+    ids, direction, stp, hip, knee, ankle = kine.delete_cycles(['7'], ret=True)
+    assert len(ids) == direction.size == stp.shape[0] == ncycles - 4
+    assert 'W0C3' not in ids and 'W0C7' not in ids and 'W3C35' not in ids
+    assert kine.cycler.cyclessv.shape[0] == ncycles
+
+    meanstp, joints, rom = kine.summary()
+    for side in (0, 1):
+        assert np.allclose(meanstp[side], np.nanmean(stp[direction == side], axis=0))
+        for j, joint in enumerate((hip, knee, ankle)):
+            curve = np.nanmean(joint[direction == side], axis=0)
+            assert np.allclose(joints[side, j], curve)
+            assert np.allclose(rom[j, side * 2: side * 2 + 2], (curve.min(), curve.max()))
+
+
+def test_invalidate():
+    u"""Un cambio de parámetros vuelve a procesar las caminatas."""
+    walks = [step_walk(wid) for wid in range(2)]
+    for walk in walks:
+        walk.markers += np.arange(14) * 10
+    stepconfig = ConfigParser()
+    stepconfig.read_string(cstring)
+    stepconfig.set('kinematics', 'leftthreshold', '3.2')
+    stepconfig.set('kinematics', 'rightthreshold', '3.2')
+    kine = kinematics.Kinematics(stepconfig)
+    kine.cycle_walks(walks)
+    cycles = kine.cycler.cyclessv.copy()
+    assert cycles.shape[0] == 20
+    # Sin cambios de parámetros se conservan los resultados.
+    kine.invalidate()
+    kine.cycle_walks(walks)
+    assert np.array_equal(kine.cycler.cyclessv, cycles)
+    stepconfig.set('kinematics', 'leftthreshold', '1000')
+    kine.invalidate()
+    kine.cycle_walks(walks)
+    assert kine.cycler.cyclessv.shape[0] == 0
+    assert kine.to_plot()[2].shape[0] == 0
+
+    # Una caminata que falla deja los resultados desactualizados.
+    broken = step_walk(2)
+    broken.find_markers.side_effect = ValueError
+    stepconfig.set('kinematics', 'leftthreshold', '3.2')
+    kine.invalidate()
+    try:
+        kine.cycle_walks(walks + [broken])
+    except ValueError:
+        pass
+    assert kine.stale
+    kine.cycle_walks(walks)
+    assert np.array_equal(kine.cycler.cyclessv, cycles)
+
+    # Las caminatas de otro video reemplazan a las anteriores.
+    kine.cycle_walks([])
+    assert kine.cycler.cyclessv.shape[0] == 0
+    kine.cycle_walks(walks[:1])
+    assert np.array_equal(kine.cycler.cyclessv, cycles[:10])
+
+
 # def test_kinematics():
 #     kine = kinematics1.Kinematics(config)
 #     kine.cycle_walks([walk, walk, walk, walk, walk ])
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""Docstring."""
+
+# Copyright (C) 2019  Mariano Ramis
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+from configparser import ConfigParser
+
+sys.path.insert(0, os.path.join(os.path.abspath('.'), 'src'))
+import profiling
+
+
+cstring = """
+[profiling]
+enabled = True
+cprofile = walks
+"""
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.delenv(profiling.ENVIRON, raising=False)
+    profiler = profiling.Profiler()
+    profiler.configure(ConfigParser())
+    with profiler.stage('decode', frames=1) as stage:
+        stage.cycles = 2
+    assert not profiler.enabled and profiler.stages == {}
+    assert profiler.save(tempfile.gettempdir()) is None
+
+    monkeypatch.setenv(profiling.ENVIRON, 'detect')
+    profiler.configure(ConfigParser())
+    assert profiler.enabled and profiler.cprofile == 'detect'
+
+
+def test_report(monkeypatch):
+    monkeypatch.delenv(profiling.ENVIRON, raising=False)
+    config = ConfigParser()
+    config.read_string(cstring)
+    profiler = profiling.Profiler()
+    profiler.configure(config)
+    for __ in range(3):
+        with profiler.stage('walks', frames=100) as stage:
+            stage.cycles = 4
+            sum(range(10000))
+    profiler.merge({'walks': {'seconds': 0., 'calls': 1, 'frames': 50,
+                              'cycles': 0}})
+    report = profiler.report()
+    walks = report['stages']['walks']
+    assert (walks['calls'], walks['frames'], walks['cycles']) == (4, 350, 12)
+    assert walks['frames_per_s'] > 0
+
+    tmpdir = tempfile.mkdtemp()
+    path = profiler.save(tmpdir)
+    with open(path) as fh:
+        assert json.load(fh)['stages']['walks']['calls'] == 4
+    assert os.path.isfile(os.path.join(tmpdir, 'profiling-walks.prof'))
+    shutil.rmtree(tmpdir)
@@ -94,3 +94,140 @@ def test_joint_plot():
     plotter.add_cycle('idd', spt, angles, withlabels=True)
     plotter.add_cycler(walk, diff, mov)
     plotter.saveplots(withtext=True)
+
+
+def session_config():
+    import settings
+    fullconfig = ConfigParser()
+    fullconfig.read_string(settings.DEFAULT_CONFIG.format(
+        APP='', HOME='', NORMAL=settings.NORMAL_DIR))
+    return fullconfig
+
+
+def session_results(ncycles=12, nfix=100):
+    direction = np.arange(ncycles) % 2
+    labels = np.array(['W0C%d' % c for c in range(ncycles)])
+    X = np.linspace(-np.pi, np.pi, nfix)
+    curves = np.sin(X) * 10 + np.random.random((ncycles, nfix))
+    vlines = 55 + np.random.random(ncycles) * 10
+    return direction, labels, curves, vlines
+
+
+def test_renderer():
+    import tempfile
+    fullconfig = session_config()
+    direction, labels, curves, vlines = session_results()
+    outputs = []
+    for workers in ('1', '2'):
+        fullconfig.set('plots', 'workers', workers)
+        destpath = tempfile.mkdtemp()
+        renderer = representation.Renderer(fullconfig)
+        renderer.add(representation.render_walk, fullconfig, destpath, 0,
+                     np.random.random((2, 50)), np.arange(50) % 7 > 3)
+        renderer.add(representation.render_angles, fullconfig, destpath,
+                     'Cinematica', (('cadera', curves), ('rodilla', curves)),
+                     direction, labels, vlines, False, True)
+        renderer.add(representation.render_angles, fullconfig, destpath,
+                     'Cadera', (('hip', curves),), direction, labels, vlines,
+                     True)
+        renderer.add(representation.render_table, fullconfig, destpath,
+                     representation.ROM, 'Rango de movimiento',
+                     np.random.random((3, 4)).round(1))
+        renderer.run()
+        outputs.append(sorted(listdir(destpath)))
+        for name in outputs[-1]:
+            remove(path.join(destpath, name))
+    assert outputs[0] == outputs[1]
+    assert outputs[0] == ['Cadera.png', 'Ciclado de caminata W0.png',
+                          'Cinematica.png', 'Rango de movimiento.png']
+
+
+def test_normal_data():
+    import os
+    import shutil
+    import tempfile
+    fullconfig = session_config()
+    dirpath = tempfile.mkdtemp()
+    for name in listdir(fullconfig.get('paths', 'normal')):
+        if name.endswith('.csv'):
+            shutil.copy(path.join(fullconfig.get('paths', 'normal'), name), dirpath)
+    fullconfig.set('paths', 'normal', dirpath)
+    normal = representation.NormalData.from_config(fullconfig)
+    assert representation.NormalData.from_config(fullconfig) is normal
+    hip = normal.get('hip')
+    with open(path.join(dirpath, 'hip.csv')) as fh:
+        assert np.array_equal(hip, np.loadtxt(fh, delimiter=','))
+    assert not hip.flags.writeable
+    assert normal.get('hip') is hip
+    assert 'normal.npz' in listdir(dirpath)
+
+    # Un registro nuevo lee la copia binaria.
+    assert np.array_equal(representation.NormalData(dirpath).get('rom'),
+                          normal.get('rom'))
+    # Si cambia un csv se vuelve a leer.
+    np.savetxt(path.join(dirpath, 'rom.csv'), np.zeros((2, 3)), delimiter=',')
+    os.utime(path.join(dirpath, 'rom.csv'), ns=(0, 0))
+    assert not normal.get('rom').any()
+    assert not representation.NormalData(dirpath).get('rom').any()
+    # Una copia binaria incompleta se ignora y se reemplaza.
+    npzpath = path.join(dirpath, 'normal.npz')
+    with open(npzpath, 'r+b') as fh:
+        fh.truncate(100)
+    assert np.array_equal(representation.NormalData(dirpath).get('hip'), hip)
+    assert sorted(n for n in listdir(dirpath) if not n.endswith('.csv')) == [
+        'normal.npz']
+    with np.load(npzpath) as npz:
+        assert np.array_equal(npz['hip'], hip)
+    shutil.rmtree(dirpath)
+
+
+def test_table_export():
+    import csv
+    import tempfile
+    from matplotlib.collections import LineCollection
+    fullconfig = session_config()
+    destpath = tempfile.mkdtemp()
+    table = representation.SpatioTemporal(fullconfig, 'Tabla')
+    table.build(np.arange(12).reshape(6, 2) / 10)
+    assert [type(a) for a in table.figure.artists].count(LineCollection) == 1
+    assert len(table.figure.artists) == 1
+    assert len(table.figure.texts) == 1 + 7 * 4  # Título y celdas.
+    table.save(destpath)
+    with open(table.export(destpath, 'csv')) as fh:
+        rows = list(csv.reader(fh))
+    assert rows[0] == ['', 'Izquierdo', 'Derecho', 'Normal [norm ± dev]']
+    assert rows[1][:3] == ['Duración [s]', '0.0', '0.1']
+    assert '±' in rows[1][3]
+    with open(table.export(destpath, 'html')) as fh:
+        assert fh.read().count('<tr>') == 7
+
+    direction, labels, __, __ = session_results(5)
+    stp = np.random.random((5, 6))
+    with open(representation.export_cycles(destpath, labels, direction, stp)) as fh:
+        rows = list(csv.reader(fh))
+    assert len(rows) == 6 and rows[1][:2] == ['W0C0', 'Izquierdo']
+    assert np.allclose(np.array(rows[1:])[:, 2:].astype(float), stp, atol=1e-3)
+    for name in listdir(destpath):
+        remove(path.join(destpath, name))
+
+
+def test_templates():
+    import tempfile
+    fullconfig = session_config()
+    destpath = tempfile.mkdtemp()
+    figures = []
+    for ncycles in (12, 4):
+        direction, labels, curves, vlines = session_results(ncycles)
+        plot = representation.AnglePlot('Cinematica', config=fullconfig)
+        plot.add_joint('cadera', direction, labels, curves, vlines)
+        plot.plot(putlegends=True)
+        plot.save(destpath)
+        figures.append(plot.figure)
+        visible = [l for l in plot.template.lines[0] if l.get_visible()]
+        assert len(visible) == ncycles
+        assert len(plot.axes[-1].get_legend().get_texts()) == ncycles
+        ymin, ymax = plot.axes[0].get_ylim()
+        assert ymin < curves.min() and curves.max() < ymax
+    assert figures[0] is figures[1]
+    assert len(plot.template.lines[0]) == 12
+    remove(path.join(destpath, 'Cinematica.png'))
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""Docstring."""
+
+# Copyright (C) 2019  Mariano Ramis
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import tempfile
+import numpy as np
+import cv2
+
+from configparser import ConfigParser
+
+sys.path.insert(0, os.path.join(os.path.abspath('.'), 'src'))
+import video
+
+
+cstring = """
+[current]
+cache =
+
+[explorer]
+dilate = False
+threshold = 240
+backend = contours
+tracking = False
+workers = 1
+chunksize = 600
+
+[video]
+buffersize = 64
+
+[walk]
+roiwidth = 125
+roiheight = 35
+
+[schema]
+n = 7
+r = 3
+foot = 5,6
+markersxroi = 0,1/2,3/4,5,6
+"""
+
+config = ConfigParser()
+config.read_string(cstring)
+
+videopath = os.path.join(tempfile.gettempdir(), 'masmarcha-test.avi')
+
+
+def make_video(path, nframes=400, width=640, height=480):
+    u"""Genera un video con dos caminatas de siete marcadores."""
+    fourcc = cv2.VideoWriter_fourcc(*'MJPG')
+    out = cv2.VideoWriter(path, fourcc, 60, (width, height))
+    ypos = (60, 120, 170, 250, 330, 420, 430)
+    xpos = (0, 5, 10, 15, 20, 0, 40)
+    for f in range(nframes):
+        frame = np.full((height, width, 3), 30, np.uint8)
+        t = f % 200
+        if 20 <= t < 180:
+            for i, (dx, y) in enumerate(zip(xpos, ypos)):
+                if i == 3 and t % 23 == 0:
+                    continue  # Marcador oculto.
+                x = int(t * 3 + dx + (15 * np.sin(t / 8 + i) if i > 4 else 0))
+                cv2.circle(frame, (x, y), 6, (255, 255, 255), -1)
+        out.write(frame)
+    out.release()
+
+
+def synthetic_walk(nframes, config=config):
+    u"""Construye una caminata con cuadros incompletos sin leer un video."""
+    walk = video.Walk(0, config)
+    ypos = np.array((60, 120, 170, 250, 330, 420, 430))
+    xpos = np.array((0, 5, 10, 15, 20, 0, 40))
+    for f in range(nframes):
+        x = f * 2 + xpos + np.where(np.arange(7) > 4, 15 * np.sin(f / 8), 0)
+        centers = np.array((x, ypos), dtype=np.int16).transpose()
+        if f % 17 == 3 and f < nframes - 1:
+            walk.append_centers(f + 1, False, np.delete(centers, 3, axis=0))
+        else:
+            walk.append_centers(f + 1, True, centers)
+    walk.append_centers(nframes + 1, False, np.array([], dtype=np.int16))
+    walk.append_stop()
+    return walk
+
+
+def find_walks(section='explorer', **options):
+    for key, value in options.items():
+        config.set(section, key, value)
+    explorer = video.Explorer(config)
+    explorer.open_file(videopath)
+    explorer.find_walks()
+    config.read_string(cstring)
+    return explorer.walks
+
+
+def test_parallel_find_walks():
+    make_video(videopath)
+    walks = find_walks()
+    pwalks = find_walks(workers='3', chunksize='50')
+    assert len(walks) == len(pwalks) == 2
+    for walk, pwalk in zip(walks, pwalks):
+        assert walk.info == pwalk.info
+        assert np.array_equal(walk._array, pwalk._array)
+    os.remove(videopath)
+
+
+def test_tracks_cache():
+    make_video(videopath)
+    cachedir = tempfile.mkdtemp()
+    walks = find_walks('current', cache=cachedir)
+    assert len(os.listdir(cachedir)) == 1
+    # Con el video sin cambios la segunda exploración se lee del cache.
+    config.set('current', 'cache', cachedir)
+    tracks = video.Tracks(config, videopath)
+    assert tracks.cached
+    cwalks = find_walks('current', cache=cachedir)
+    assert len(walks) == len(cwalks) == 2
+    for walk, cwalk in zip(walks, cwalks):
+        assert np.array_equal(walk._array, cwalk._array)
+    os.remove(tracks.path)
+    os.rmdir(cachedir)
+    os.remove(videopath)
+
+
+def test_tracks_key():
+    open(videopath, 'wb').close()
+
+    def key(*options):
+        for section, option, value in options:
+            config.set(section, option, value)
+        value = video.Tracks(config, videopath).key()
+        config.read_string(cstring)
+        return value
+
+    tracking = ('explorer', 'tracking', 'True')
+    parallel = ('explorer', 'workers', '3')
+    chunks = ('explorer', 'chunksize', '50')
+    roi = ('walk', 'roiwidth', '50')
+    assert key(roi) == key()
+    assert key(tracking) != key()
+    assert key(tracking, roi) != key(tracking)
+    assert key(tracking, chunks) == key(tracking)
+    assert key(tracking, parallel, chunks) != key(tracking, parallel)
+    os.remove(videopath)
+
+
+def test_components_backend():
+    make_video(videopath)
+    walks = find_walks()
+    cwalks = find_walks(backend='components')
+    assert len(walks) == len(cwalks) == 2
+    for walk, cwalk in zip(walks, cwalks):
+        assert np.array_equal(walk._array, cwalk._array)
+    os.remove(videopath)
+
+
+def test_components_nested():
+    vid = video.Video(config)
+    ring = np.zeros((100, 100, 3), np.uint8)
+    cv2.circle(ring, (50, 50), 20, (255, 255, 255), 3)
+    cv2.circle(ring, (50, 50), 4, (255, 255, 255), -1)  # Dentro del anillo.
+    cv2.circle(ring, (10, 10), 3, (255, 255, 255), -1)
+    # Un punto dentro del rectángulo de un arco abierto no está anidado.
+    arc = np.zeros((100, 100, 3), np.uint8)
+    cv2.ellipse(arc, (50, 50), (30, 30), 0, 40, 320, (255, 255, 255), 3)
+    cv2.circle(arc, (60, 50), 3, (255, 255, 255), -1)
+    for frame in (ring, arc):
+        n, contours = vid.contours(frame)
+        m, centers = vid.components(frame)
+        assert n == m == 2
+        assert np.array_equal(vid.centers(contours), centers)
+
+
+def test_tracking():
+    make_video(videopath)
+    walks = find_walks()
+    twalks = find_walks(tracking='True')
+    assert len(walks) == len(twalks) == 2
+    for walk, twalk in zip(walks, twalks):
+        assert np.array_equal(walk._array, twalk._array)
+    os.remove(videopath)
+
+
+def test_frames():
+    make_video(videopath, nframes=60)
+    vid = video.Video(config)
+    vid.open(videopath)
+    config.set('video', 'buffersize', '1')
+    threaded = [(pos, frame.copy()) for pos, frame in vid.frames(10, 50)]
+    config.set('video', 'buffersize', '0')
+    sequential = [(pos, frame.copy()) for pos, frame in vid.frames(10, 50)]
+    config.read_string(cstring)
+    assert [p for p, __ in threaded] == list(range(11, 51))
+    assert [p for p, __ in sequential] == list(range(11, 51))
+    for (__, a), (__, b) in zip(threaded, sequential):
+        assert np.array_equal(a, b)
+    os.remove(videopath)
+
+
+def test_frames_reused_capture():
+    make_video(videopath)
+    walks = find_walks()
+    explorer = video.Explorer(config)
+    explorer.open_file(videopath)
+    # Una vista previa interrumpida deja la captura más adelante.
+    for pos, frame in explorer.video.frames(0, 100):
+        if pos == 5:
+            break
+    explorer.find_walks()
+    assert [w.info for w in explorer.walks] == [w.info for w in walks]
+    # Después de explorar, el video se puede volver a recorrer desde el inicio.
+    assert len(list(explorer.video.frames(0, 100))) == 100
+    os.remove(videopath)
+
+
+def test_find_walks_onwalk_error():
+    from queue import Queue
+    make_video(videopath)
+    explorer = video.Explorer(config)
+    explorer.open_file(videopath)
+    calls = []
+
+    def onwalk(walk):
+        calls.append(walk)
+        raise ValueError
+
+    pqueue = Queue()
+    explorer.find_walks(pqueue, onwalk)
+    assert len(explorer.walks) == 2 and len(calls) == 1
+    values = [pqueue.get() for __ in range(pqueue.qsize())]
+    assert values[-1] == -1
+    os.remove(videopath)
+
+
+def test_make_pics():
+    make_video(videopath)
+    walks = find_walks()
+    config.set('current', 'pics', tempfile.mkdtemp())
+    # Ciclos de las dos caminatas, con cuadros repetidos y desordenados.
+    cycles = np.array(((0, 0, 0, 10, 60, 60),
+                       (1, 1, 1, 5, 90, 150),
+                       (2, 0, 0, 0, 30, 159)), dtype=np.int32)
+    pics = video.Pics(config)
+    pics.open(videopath)
+    pics.make_pics(cycles, walks)
+    assert sorted(os.listdir(config.get('current', 'pics'))) == [
+        'W0C0.png', 'W0C2.png', 'W1C1.png']
+    for cycle in cycles:
+        walk = walks[cycle[1]]
+        frames = [pics.frame_from_cycle(c) for c in cycle[3:] + walk.info[1]]
+        centers = [pics.calc_xcenter(walk, pos) for pos in cycle[3:]]
+        expected = pics.build_pic([pics.cut_frame(f, c)
+                                   for f, c in zip(frames, centers)])
+        path = os.path.join(config.get('current', 'pics'),
+                            'W%dC%d.png' % (cycle[1], cycle[0]))
+        assert np.array_equal(cv2.imread(path), expected)
+        os.remove(path)
+    os.rmdir(config.get('current', 'pics'))
+    config.remove_option('current', 'pics')
+    os.remove(videopath)
+
+
+def test_long_walk():
+    walk = synthetic_walk(3000)
+    assert walk.info == (0, 1, 3000)
+    assert len(walk.incompleted) == 178
+    walk.find_markers()
+    # Sólo la región del marcador oculto queda para interpolar.
+    assert np.array_equal(walk.arrincompleted.sum(axis=0), (0, 177, 0))
+
+
+def test_sort_foot():
+    def reference(walk):
+        u"""Ordenamiento de los marcadores de pie, fila por fila."""
+        indexes = np.array(walk.markersxroi[2])
+        x = 2 + indexes * 2
+        y = 2 + indexes * 2 + 1
+        indexes = np.array((x, y)).transpose()
+        ia, ib, ic = indexes
+        ma, mb, mc = [walk._array[:, xy] for xy in indexes]
+        segments = np.array((ma-mb, mb-mc, mc-ma))
+        sequence = np.array(((ia, ib), (ib, ic), (ic, ia)))
+        distances = np.linalg.norm(segments, axis=2).transpose()
+        ordered_distances = np.argsort(distances)
+        array = walk._array.copy()
+        for r, (A, B, C) in enumerate(sequence[ordered_distances]):
+            ix = np.hstack((np.intersect1d(A, C), np.intersect1d(A, B),
+                            np.intersect1d(B, C)))
+            array[r, indexes.flatten()] = array[r, ix]
+        return array
+
+    rng = np.random.RandomState(0)
+    for __ in range(20):
+        walk = synthetic_walk(200)
+        foot = np.hstack((walk.ixmarkers[-1], walk.iymarkers[-1]))
+        walk._array[:, foot] = rng.randint(0, 640, (200, foot.size))
+        expected = reference(walk)
+        walk.sort_foot()
+        assert np.array_equal(walk._array, expected)
+
+
+def test_recover_incompleted():
+    walk = synthetic_walk(300)
+    # Centros espurios dentro de la región de los marcadores de pie.
+    extra = np.array(((10, 425),), dtype=np.int16)
+    walk._incvalues[3] = extra
+    walk.calculate_regions()
+    walk.interpolate_regions()
+    expected = walk._array.copy()
+    axis = walk.arrnrows[np.logical_not(walk.arrcompleted)]
+    for pos, centers in zip(axis, walk.incompleted):
+        for r, (ix, iy) in enumerate(zip(walk.ixregion, walk.iyregion)):
+            (x0, x1), (y0, y1) = expected[pos, ix], expected[pos, iy]
+            x = np.logical_and(centers[:, 0] > x0, centers[:, 0] < x1)
+            y = np.logical_and(centers[:, 1] > y0, centers[:, 1] < y1)
+            substitution = centers[np.logical_and(x, y)]
+            recovered = len(substitution) == len(walk.markersxroi[r])
+            if recovered:
+                expected[pos, walk.imarkers[r]] = substitution.flatten()
+            expected[pos, walk.iincompleted[r]] = not recovered
+    walk.recover_incompleted()
+    assert np.array_equal(walk._array, expected)